@@ -1,15 +1,136 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
-import requests
-import aiohttp
+from tkinter import ttk, messagebox, filedialog, simpledialog
 import asyncio
 import threading
 import time
+import os
+import json
+import itertools
+import multiprocessing
+import sqlite3
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 import numpy as np
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from PIL import Image, ImageTk
-from io import BytesIO
+
+from weather_core import (
+    FORECAST_VARIABLES, JSON_BACKEND, PHASES, decode_observation, decode_group, decode_forecast,
+    timed_sync_get, read_timed, format_phases, create_sync_session, create_async_session,
+    create_replay_session, process_fetch_city, init_process_worker, TrafficRecorder, TrafficReplay,
+    RecordingSession, ReplaySession,
+    WeatherCache, PersistentWeatherCache, UPSTREAM_SOURCES, ChangeTracker, RefreshSchedule,
+    SingleFlight, CityIdIndex, TokenBucket, BatchScheduler, AdaptiveScheduler, MetricsStore,
+    ForecastSeries, iter_city_file, ResultWriter, ResultStore
+)
+
+class VirtualTable(ttk.Frame):
+    # Treeview that only holds the rows currently on screen. Scrolling, sorting and filtering
+    # point those items at a different part of a ResultStore, so a redraw costs the same
+    # whether the store holds ten rows or a hundred thousand
+    def __init__(self, parent, store, headings, height=10):
+        super().__init__(parent)
+        self.store = store
+        self.headings = headings
+        self.sort_column = None
+        self.descending = False
+        self.failures_only = False
+        self.offset = 0
+        self.visible = height
+        self.follow = True  # keep the newest rows in view as results arrive
+        self._order = None  # slots in display order while sorted or filtered
+        self._generation = None
+        
+        self.tree = ttk.Treeview(self, columns=store.COLUMNS, show='headings', height=height)
+        for column in store.COLUMNS:
+            self.tree.heading(column, text=headings[column], command=lambda c=column: self.sort_by(c))
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.scroll)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.row_height = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll("scroll", -1 if e.delta > 0 else 1, "units"))
+        self.tree.bind("<Button-4>", lambda e: self.scroll("scroll", -1, "units"))
+        self.tree.bind("<Button-5>", lambda e: self.scroll("scroll", 1, "units"))
+        self.render()
+
+    def total(self):
+        if self._generation != self.store.generation:
+            self._generation = self.store.generation
+            self._order = (self.store.select(self.failures_only, self.sort_column, self.descending)
+                           if self.failures_only or self.sort_column else None)
+        return len(self.store) if self._order is None else len(self._order)
+
+    def render(self):
+        total = self.total()
+        last = max(total - self.visible, 0)
+        self.offset = last if self.follow else min(self.offset, last)
+        
+        items = self.tree.get_children()
+        if len(items) < self.visible:
+            for _ in range(self.visible - len(items)):
+                self.tree.insert('', tk.END)
+            items = self.tree.get_children()
+        shown = min(self.visible, total - self.offset)
+        for i in range(shown):
+            position = self.offset + i
+            slot = self.store.slot_at(position) if self._order is None else self._order[position]
+            self.tree.item(items[i], values=self.store.row(slot))
+        for item in items[shown:]:
+            self.tree.item(item, values=())
+        
+        if total:
+            self.scrollbar.set(self.offset / total, (self.offset + shown) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll(self, action, amount, unit=None):
+        # Scrollbar command protocol: ("moveto", fraction) or ("scroll", count, "units" | "pages")
+        total = self.total()
+        if action == "moveto":
+            self.offset = int(float(amount) * total)
+        else:
+            self.offset += int(amount) * (self.visible if unit == "pages" else 1)
+        self.offset = min(max(self.offset, 0), max(total - self.visible, 0))
+        self.follow = self.sort_column is None and self.offset >= total - self.visible
+        self.render()
+
+    def sort_by(self, column):
+        # Click once for ascending, again for descending, a third time for arrival order
+        if self.sort_column != column:
+            self.sort_column, self.descending = column, column == "Time"  # slowest first
+        elif self.descending == (column != "Time"):
+            self.sort_column = None
+        else:
+            self.descending = not self.descending
+        for name in self.store.COLUMNS:
+            arrow = (" ▼" if self.descending else " ▲") if name == self.sort_column else ""
+            self.tree.heading(name, text=self.headings[name] + arrow)
+        self.show_from_top()
+
+    def set_failures_only(self, failures_only):
+        self.failures_only = failures_only
+        self.show_from_top()
+
+    def show_from_top(self):
+        self._generation = None
+        self.follow = self.sort_column is None
+        self.offset = 0
+        self.render()
+
+    def on_resize(self, event):
+        # One row of the widget's height goes to the headings
+        visible = max(event.height // self.row_height - 1, 1)
+        if visible != self.visible:
+            self.visible = visible
+            items = self.tree.get_children()
+            if len(items) > visible:
+                self.tree.delete(*items[visible:])
+            self.render()
 
 class WeatherComparisonApp:
     def __init__(self, root):
@@ -20,14 +141,149 @@ class WeatherComparisonApp:
         # Configuration
         self.API_KEY = "Your API Key"  # Replace with your OpenWeatherMap API key
         self.WEATHER_URL = "http://api.openweathermap.org/data/2.5/weather"
+        self.GROUP_URL = "http://api.openweathermap.org/data/2.5/group"
+        self.FORECAST_URL = "http://api.openweathermap.org/data/2.5/forecast"
+        self.FORECAST_TOP_K = 10  # hottest cities listed and drawn on the forecast page
+        self.GROUP_SIZE = 20  # maximum city ids per group request
         self.DEFAULT_CITIES = ["London", "Paris", "Tokyo", "New York", "Sydney"]
+        self.UNITS = "metric"
+        
+        # Execution strategies: (key, label, colour)
+        self.STRATEGIES = [
+            ("sync", "Sync", "red"),
+            ("async", "Async", "blue"),
+            ("group", "Group", "green"),
+            ("threaded", "Threaded", "orange"),
+            ("process", "Process", "purple"),
+            ("forecast", "Forecast", "teal"),
+            ("concurrency", "Concurrency Test", "gray")
+        ]
+        self.THREAD_WORKERS = 10
+        self.PROCESS_WORKERS = os.cpu_count() or 2
+        
+        # Async connection pool configuration
+        self.POOL_LIMIT = 100
+        self.POOL_LIMIT_PER_HOST = 20
+        self.DNS_CACHE_TTL = 300
+        self.KEEPALIVE_TIMEOUT = 30
+        
+        # Sync connection pool configuration
+        self.SYNC_POOL_SIZE = 20
+        self.SYNC_MAX_RETRIES = 3
+        self.SYNC_BACKOFF_FACTOR = 0.5
+        
+        # Response cache configuration
+        self.CACHE_TTL = 600  # seconds
+        self.CACHE_MAX_ENTRIES = 256
+        self.PERSISTENT_CACHE_PATH = "weather_cache.sqlite3"  # None keeps the cache in memory only
+        self.PERSISTENT_CACHE_MAX_ROWS = 10000
+        self.PERSISTENT_CACHE_FLUSH_INTERVAL = 2.0  # seconds between batched disk writes
+        
+        # Change detection and auto-refresh
+        self.UPSTREAM_CADENCE = 600  # seconds between upstream updates until one is observed
+        self.UPSTREAM_RETRY = 60  # seconds to wait when an expected update hasn't appeared yet
+        self.AUTO_REFRESH_INTERVAL = 300  # default seconds between refreshes of a city
+        self.AUTO_REFRESH_JITTER = 0.1  # fraction of the interval refreshes are spread by
+        self.AUTO_REFRESH_GRACE = 5.0  # seconds late before a refresh counts as a missed deadline
+        self.AUTO_REFRESH_TICK = 0.5  # seconds between bulk table updates
+        
+        # Record/replay of upstream traffic
+        self.REPLAY_SCALE = 1.0  # default multiplier for recorded latencies
+        
+        # Batch scheduling configuration (match these to the API plan tier)
+        self.MAX_IN_FLIGHT = 20
+        self.RATE_LIMIT_PER_MINUTE = 60
+        self.SWEEP_LIMITS = [1, 2, 5, 10, 20, 50]
+        self.SWEEP_KNEE_GAIN = 0.1  # minimum relative throughput gain to keep raising the limit
+        
+        # Adaptive (AIMD) concurrency limits
+        self.ADAPTIVE_INITIAL_LIMIT = 4
+        self.ADAPTIVE_MIN_LIMIT = 1
+        self.ADAPTIVE_MAX_LIMIT = 200
+        self.ADAPTIVE_BACKOFF = 0.5  # multiplicative cut on congestion
+        self.ADAPTIVE_LATENCY_TOLERANCE = 2.0  # recent p90 above this multiple of the baseline p90 is a spike
+        
+        # Per-strategy request budgets, applied when enabled on the batch page.
+        # Hedging sends a duplicate once a request outlives this percentile of recent
+        # latency (async only); the deadline cancels whatever a batch still has running.
+        self.HEDGE_PERCENTILES = {"sync": None, "async": 95, "group": None, "threaded": None, "process": None,
+                                  "forecast": None, "concurrency": None}
+        self.BATCH_DEADLINES = {"sync": 30.0, "async": 10.0, "group": 10.0, "threaded": 15.0, "process": 15.0,
+                                "forecast": 20.0, "concurrency": None}
+        self.HEDGE_WINDOW = 200  # recent latencies the hedge percentile is taken over
+        self.HEDGE_MIN_SAMPLES = 20
+        
+        # Metrics retention (most recent requests kept for graphs and the timeline)
+        self.METRICS_CAPACITY = 100000
+        self.TIMELINE_PHASE_REQUESTS = 100  # requests shown in the phase breakdown
+        self.TIMELINE_MAX_BARS = 2000  # Gantt bars drawn before downsampling
+        self.TIMELINE_MAX_POINTS = 4000  # points in the in-flight curve before downsampling
+        self.TIMELINE_LABEL_LIMIT = 40  # label Gantt rows with city names up to this many
+        self.METRICS_MAX_CITIES = 1000  # cities with their own latency histogram
+        self.PHASE_COLORS = {
+            "queue": "lightgray",
+            "dns": "gold",
+            "connect": "orange",
+            "tls": "firebrick",
+            "ttfb": "steelblue",
+            "body": "mediumseagreen",
+            "decode": "purple"
+        }
         
         # Data storage
-        self.sync_times = []
-        self.async_times = []
-        self.sync_success = 0
-        self.async_success = 0
-        self.request_history = []
+        self.metrics = MetricsStore([key for key, _, _ in self.STRATEGIES], capacity=self.METRICS_CAPACITY,
+                                    max_cities=self.METRICS_MAX_CITIES)
+        self.requested_concurrency = None  # in-flight limit of the last concurrency test
+        self.cache = self.create_cache()
+        self.bypass_cache_var = tk.BooleanVar(value=False)
+        self.single_flight = SingleFlight()
+        self.changes = ChangeTracker(cadence=self.UPSTREAM_CADENCE, retry=self.UPSTREAM_RETRY)
+        if isinstance(self.cache, PersistentWeatherCache):
+            # ETags saved by an earlier run make the first refetch of each city conditional
+            for key, observation, etag in self.cache.validators(self.changes.max_entries):
+                self.changes.remember(key, observation, etag)
+        self.auto_refresh = None  # future of the running auto-refresh engine
+        self.refresh_schedule = None
+        self.auto_refresh_text = tk.StringVar(value="Start Auto-Refresh")
+        self.city_ids = CityIdIndex()
+        self.thread_workers_var = tk.IntVar(value=self.THREAD_WORKERS)
+        self.process_pool = None
+        self.blocking_demo_var = tk.BooleanVar(value=False)
+        # Single worker keeps sync requests sequential while keeping them off the Tk thread
+        self.sync_worker = ThreadPoolExecutor(max_workers=1)
+        self.max_in_flight_var = tk.IntVar(value=self.MAX_IN_FLIGHT)
+        self.adaptive_var = tk.BooleanVar(value=False)
+        self.budgets_var = tk.BooleanVar(value=False)
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self.limit_history = deque(maxlen=10000)  # (perf_counter, limit) from adaptive runs
+        self.rate_limit_var = tk.IntVar(value=self.RATE_LIMIT_PER_MINUTE)
+        self.upstream_bucket = None  # the one TokenBucket all async upstream calls draw from
+        
+        # Shared pooled session for all sync requests; record/replay swap its transport
+        self.recorder = None
+        self.replay = None
+        self.http = self.create_http_session()
+        
+        # Worker threads queue UI updates here; the Tk loop applies them once per frame
+        self.UI_FRAME_MS = 50
+        self.RESULTS_CAPACITY = 100000  # most recent rows kept for the results table
+        self.ui_queue = queue.SimpleQueue()
+        self.results = ResultStore(self.RESULTS_CAPACITY)
+        self.failures_only_var = tk.BooleanVar(value=False)
+        self.batch_summary_var = tk.StringVar(value="")
+        
+        # Streaming batches from a city list file
+        self.STREAM_WORKERS = 100  # consumer coroutines; the scheduler still caps requests in flight
+        self.STREAM_QUEUE_SIZE = 500  # cities read ahead of the workers
+        self.STREAM_READ_CHUNK = 100  # lines read from the file per executor call
+        
+        # Shared event loop and session for all async requests
+        self.session = None
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.run_event_loop, daemon=True)
+        self.loop_thread.start()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         # UI Setup
         self.create_menu_bar()
@@ -36,6 +292,8 @@ class WeatherComparisonApp:
         
         # Load default icon
         self.load_default_icon()
+        
+        self.root.after(self.UI_FRAME_MS, self.drain_ui_queue)
 
     def load_default_icon(self):
         try:
@@ -47,6 +305,333 @@ class WeatherComparisonApp:
             pass
             # self.tk_weather_icon = None
 
+    def run_event_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit_async(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def get_session(self):
+        # Only ever called on the loop thread, so no locking is needed
+        if self.session is None or self.session.closed:
+            if self.replay is not None:
+                self.session = ReplaySession(self.replay)
+                return self.session
+            self.session = create_async_session(
+                limit=self.POOL_LIMIT,
+                limit_per_host=self.POOL_LIMIT_PER_HOST,
+                dns_ttl=self.DNS_CACHE_TTL,
+                keepalive_timeout=self.KEEPALIVE_TIMEOUT
+            )
+            if self.recorder is not None:
+                self.session = RecordingSession(self.session, self.recorder)
+        return self.session
+
+    def create_http_session(self, pool_size=None):
+        if self.replay is not None:
+            return create_replay_session(self.replay)
+        return create_sync_session(
+            pool_size=pool_size or self.SYNC_POOL_SIZE,
+            max_retries=self.SYNC_MAX_RETRIES,
+            backoff_factor=self.SYNC_BACKOFF_FACTOR,
+            recorder=self.recorder
+        )
+
+    def set_traffic(self, recorder=None, replay=None):
+        # Switches both transports between live, recording and replay
+        # (responses still in flight on a closed recorder are dropped)
+        if self.recorder is not None:
+            self.recorder.close()
+        self.recorder, self.replay = recorder, replay
+        previous_http, self.http = self.http, self.create_http_session()
+        previous_http.close()
+        self.submit_async(self.reset_async_session())
+        
+        # Process pool workers pick their transport up when they start, so start new ones
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+            self.process_pool = None
+
+    async def reset_async_session(self):
+        # The next get_session() builds a session for the current traffic mode
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def start_recording(self):
+        path = filedialog.asksaveasfilename(
+            title="Record upstream traffic to",
+            defaultextension=".jsonl.gz",
+            filetypes=[("Recorded traffic", "*.jsonl.gz"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+        try:
+            recorder = TrafficRecorder(path)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not start recording: {e}")
+            return
+        
+        self.set_traffic(recorder=recorder)
+        self.status_var.set(f"Recording upstream traffic to {os.path.basename(path)}")
+
+    def start_replay(self):
+        path = filedialog.askopenfilename(
+            title="Replay recorded traffic",
+            filetypes=[("Recorded traffic", "*.jsonl.gz"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+        scale = simpledialog.askfloat("Replay Traffic", "Latency scale (1 = as recorded):",
+                                      initialvalue=self.REPLAY_SCALE, minvalue=0.0)
+        if scale is None:
+            return
+        if self.recorder is not None:
+            self.set_traffic()  # finish the recording first, it may be the file being replayed
+        try:
+            replay = TrafficReplay(path, scale)
+        except (OSError, EOFError, ValueError, KeyError) as e:
+            messagebox.showerror("Error", f"Could not load recording: {e}")
+            return
+        
+        self.set_traffic(replay=replay)
+        self.status_var.set(f"Replaying {len(replay)} recorded responses from {os.path.basename(path)} "
+                            f"(latency x{scale:g})")
+
+    def use_live_traffic(self):
+        self.set_traffic()
+        self.status_var.set("Using the live network")
+
+    def traffic_description(self):
+        if self.replay is not None:
+            return (f"Replay x{self.replay.scale:g} ({self.replay.served} served, "
+                    f"{self.replay.missing} not recorded)")
+        if self.recorder is not None:
+            return f"Recording ({self.recorder.recorded} responses)"
+        return "Live"
+
+    async def shutdown_async(self):
+        current = asyncio.current_task()
+        pending = [task for task in asyncio.all_tasks() if task is not current]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def on_close(self):
+        try:
+            self.submit_async(self.shutdown_async()).result(timeout=5)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join(timeout=5)
+        self.loop.close()
+        self.sync_worker.shutdown(wait=False, cancel_futures=True)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+        self.http.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        self.city_ids.save()
+        if isinstance(self.cache, PersistentWeatherCache):
+            self.cache.close()
+        self.root.destroy()
+
+    def create_cache(self):
+        if self.PERSISTENT_CACHE_PATH:
+            try:
+                return PersistentWeatherCache(
+                    self.PERSISTENT_CACHE_PATH,
+                    ttl=self.CACHE_TTL,
+                    max_entries=self.CACHE_MAX_ENTRIES,
+                    max_rows=self.PERSISTENT_CACHE_MAX_ROWS,
+                    flush_interval=self.PERSISTENT_CACHE_FLUSH_INTERVAL
+                )
+            except sqlite3.Error:
+                pass  # unreadable or locked cache file; fall back to memory only
+        return WeatherCache(ttl=self.CACHE_TTL, max_entries=self.CACHE_MAX_ENTRIES)
+
+    def cache_key(self, city):
+        return (city.strip().lower(), self.UNITS)
+
+    def sync_request(self, city, use_cache=True, phases=None, http=None, track_changes=False):
+        # `http` overrides the shared session (thread-pool batches bring one sized to their workers)
+        key = self.cache_key(city)
+        if use_cache:
+            data = self.cache.get(key)
+            if data is not None:
+                return 200, data, "cache"
+        
+        headers, decode = self.change_tracking(key, track_changes)
+        response, data = timed_sync_get(
+            http or self.http,
+            self.WEATHER_URL,
+            {"q": city, "appid": self.API_KEY, "units": self.UNITS},
+            timeout=10,
+            phases=phases,
+            decode=decode,
+            headers=headers
+        )
+        status, data, changed = self.resolve_change(key, response.status_code, data, response.headers, track_changes)
+        if status == 200:
+            self.city_ids.learn(city, data.city_id)
+        return status, data, "network" if changed else "unchanged"
+
+    def change_tracking(self, key, track_changes):
+        # (request headers, decoder): conditional headers and the dt short-circuit only when
+        # tracking changes (auto-refresh); other requests fetch and decode in full
+        if track_changes:
+            return self.changes.headers(key), self.changes.decoder(key)
+        return None, decode_observation
+
+    def resolve_change(self, key, status, data, headers, track_changes):
+        # (status, observation, changed) for a response; 200s refresh the cache entry
+        if track_changes:
+            status, data, changed = self.changes.resolve(key, status, data, headers)
+            etag = self.changes.etag(key)
+        else:
+            changed, etag = True, headers.get("ETag")
+        if status == 200:
+            self.cache.put(key, data, etag)
+        return status, data, changed
+
+    async def async_request(self, session, city, use_cache=True, scheduler=None, phases=None, hedge_after=None,
+                            track_changes=False):
+        key = self.cache_key(city)
+        if not use_cache:
+            status, data, changed = await self.async_get(
+                session, city, key, scheduler, phases, hedge_after, track_changes)
+            return status, data, "network" if changed else "unchanged"
+        
+        data = self.cache.get(key)
+        if data is not None:
+            return 200, data, "cache"
+        
+        (status, data, changed), leader = await self.single_flight.do(
+            key, lambda: self.async_get(session, city, key, scheduler, phases, hedge_after, track_changes))
+        if not leader:
+            return status, data, "coalesced"
+        return status, data, "network" if changed else "unchanged"
+
+    async def async_get(self, session, city, key, scheduler=None, phases=None, hedge_after=None,
+                        track_changes=False):
+        if hedge_after is not None:
+            return await self.hedged(
+                lambda attempt_phases: self.async_get(
+                    session, city, key, phases=attempt_phases, track_changes=track_changes),
+                hedge_after, phases, scheduler)
+        if scheduler is not None:
+            return await self.run_scheduled(
+                scheduler, lambda: self.async_get(session, city, key, phases=phases, track_changes=track_changes),
+                phases)
+        
+        headers, decode = self.change_tracking(key, track_changes)
+        async with session.get(
+            self.WEATHER_URL,
+            params={"q": city, "appid": self.API_KEY, "units": self.UNITS},
+            headers=headers,
+            timeout=10,
+            trace_request_ctx=phases
+        ) as response:
+            data = await read_timed(response, phases, decode)
+            status, data, changed = self.resolve_change(key, response.status, data, response.headers, track_changes)
+            if status == 200:
+                self.city_ids.learn(city, data.city_id)
+            return status, data, changed
+
+    async def async_get_group(self, session, ids, scheduler=None, phases=None):
+        if scheduler is not None:
+            return await self.run_scheduled(
+                scheduler, lambda: self.async_get_group(session, ids, phases=phases), phases)
+        
+        async with session.get(
+            self.GROUP_URL,
+            params={"id": ",".join(str(city_id) for city_id in ids), "appid": self.API_KEY, "units": self.UNITS},
+            timeout=10,
+            trace_request_ctx=phases
+        ) as response:
+            data = await read_timed(response, phases, decode_group)
+            return response.status, data
+
+    async def async_get_forecast(self, session, city, scheduler=None, phases=None):
+        if scheduler is not None:
+            return await self.run_scheduled(
+                scheduler, lambda: self.async_get_forecast(session, city, phases=phases), phases)
+        
+        async with session.get(
+            self.FORECAST_URL,
+            params={"q": city, "appid": self.API_KEY, "units": self.UNITS},
+            timeout=10,
+            trace_request_ctx=phases
+        ) as response:
+            data = await read_timed(response, phases, decode_forecast)
+            return response.status, data
+
+    async def hedged(self, attempt, delay, phases=None, scheduler=None):
+        # Starts a duplicate attempt if the first is still running `delay` seconds after it was
+        # sent; the first attempt to succeed wins and the other is cancelled. With a scheduler
+        # each attempt, the hedge included, waits for its own slot and rate-limit token
+        def launch(attempt_phases, sent):
+            if scheduler is None:
+                sent.set()
+                return asyncio.ensure_future(attempt(attempt_phases))
+            return asyncio.ensure_future(
+                self.run_scheduled(scheduler, lambda: attempt(attempt_phases), attempt_phases, sent))
+        
+        attempt_phases = [{}]
+        sent = asyncio.Event()
+        tasks = [launch(attempt_phases[0], sent)]
+        try:
+            # Time spent queued for the scheduler doesn't count toward the hedge delay
+            sent_wait = asyncio.ensure_future(sent.wait())
+            try:
+                await asyncio.wait([tasks[0], sent_wait], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                sent_wait.cancel()
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedges_sent += 1
+                attempt_phases.append({})
+                tasks.append(launch(attempt_phases[1], asyncio.Event()))
+            
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded or not pending:
+                    winner = succeeded[0] if succeeded else done.pop()
+                    break
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        
+        index = tasks.index(winner)
+        if index:
+            self.hedges_won += 1
+        if phases is not None:
+            for phase, seconds in attempt_phases[index].items():
+                phases[phase] = phases.get(phase, 0.0) + seconds
+        return winner.result()
+
+    async def run_scheduled(self, scheduler, coro_factory, phases=None, started=None):
+        # Charges the time spent waiting on the scheduler to the "queue" phase and sets
+        # `started` once the request leaves the queue
+        queued_at = time.perf_counter()
+        
+        async def start():
+            if started is not None:
+                started.set()
+            if phases is not None:
+                phases["queue"] = phases.get("queue", 0.0) + time.perf_counter() - queued_at
+            return await coro_factory()
+        
+        return await scheduler.run(start)
+
     def create_menu_bar(self):
         menubar = tk.Menu(self.root)
         
@@ -54,13 +639,14 @@ class WeatherComparisonApp:
         file_menu = tk.Menu(menubar, tearoff=0)
         file_menu.add_command(label="Home", command=self.create_home_page)
         file_menu.add_separator()
-        file_menu.add_command(label="Exit", command=self.root.quit)
+        file_menu.add_command(label="Exit", command=self.on_close)
         menubar.add_cascade(label="File", menu=file_menu)
         
         # Request menu
         request_menu = tk.Menu(menubar, tearoff=0)
         request_menu.add_command(label="Single City Test", command=self.create_single_city_page)
         request_menu.add_command(label="Batch City Test", command=self.create_batch_city_page)
+        request_menu.add_command(label="Forecast Batch", command=self.create_forecast_page)
         menubar.add_cascade(label="Requests", menu=request_menu)
         
         # Analysis menu
@@ -76,6 +662,13 @@ class WeatherComparisonApp:
         test_menu.add_command(label="Concurrency Test", command=self.test_concurrency_limits)
         menubar.add_cascade(label="Tests", menu=test_menu)
         
+        # Traffic menu
+        traffic_menu = tk.Menu(menubar, tearoff=0)
+        traffic_menu.add_command(label="Live Network", command=self.use_live_traffic)
+        traffic_menu.add_command(label="Record Traffic...", command=self.start_recording)
+        traffic_menu.add_command(label="Replay Traffic...", command=self.start_replay)
+        menubar.add_cascade(label="Traffic", menu=traffic_menu)
+        
         self.root.config(menu=menubar)
 
     def create_status_bar(self):
@@ -152,6 +745,10 @@ class WeatherComparisonApp:
                   command=lambda: self.fetch_weather_sync(self.city_entry.get())).pack(side=tk.LEFT, padx=5)
         ttk.Button(input_frame, text="Fetch Asynchronously", 
                   command=lambda: self.fetch_weather_async(self.city_entry.get())).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(input_frame, text="Bypass cache",
+                       variable=self.bypass_cache_var).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(input_frame, text="Blocking demo",
+                       variable=self.blocking_demo_var).pack(side=tk.LEFT, padx=5)
         
         # Results frame
         results_frame = ttk.Frame(frame)
@@ -194,281 +791,975 @@ class WeatherComparisonApp:
         button_frame.pack(fill=tk.X, pady=5)
         
         ttk.Button(button_frame, text="Fetch All Synchronously", 
-                  command=lambda: self.batch_fetch(sync=True)).pack(side=tk.LEFT, padx=5)
+                  command=lambda: self.batch_fetch(mode="sync")).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Fetch All Asynchronously", 
-                  command=lambda: self.batch_fetch(sync=False)).pack(side=tk.LEFT, padx=5)
+                  command=lambda: self.batch_fetch(mode="async")).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Fetch All (Group API)", 
+                  command=lambda: self.batch_fetch(mode="group")).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Fetch All (Thread Pool)", 
+                  command=lambda: self.batch_fetch(mode="threaded")).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Fetch All (Process Pool)", 
+                  command=lambda: self.batch_fetch(mode="process")).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Stream File (Async)...",
+                  command=self.stream_file_batch).pack(side=tk.LEFT, padx=5)
+
+        # Options frame
+        options_frame = ttk.Frame(frame)
+        options_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Checkbutton(options_frame, text="Bypass cache (benchmark run)",
+                       variable=self.bypass_cache_var).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(options_frame, text="Blocking demo (sync on UI thread)",
+                       variable=self.blocking_demo_var).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(options_frame, text="Max in-flight:").pack(side=tk.LEFT, padx=(15, 0))
+        ttk.Entry(options_frame, textvariable=self.max_in_flight_var, width=5).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(options_frame, text="Adaptive",
+                       variable=self.adaptive_var).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Label(options_frame, text="Rate limit (req/min, 0 = none):").pack(side=tk.LEFT)
+        ttk.Entry(options_frame, textvariable=self.rate_limit_var, width=6).pack(side=tk.LEFT, padx=5)
+        ttk.Label(options_frame, text="Thread workers:").pack(side=tk.LEFT)
+        ttk.Entry(options_frame, textvariable=self.thread_workers_var, width=5).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(options_frame, text="Request budgets (hedging, deadline)",
+                       variable=self.budgets_var).pack(side=tk.LEFT, padx=5)
+        
+        # Progress bar
+        self.progress = ttk.Progressbar(frame, orient=tk.HORIZONTAL, mode='determinate')
+        self.progress.pack(fill=tk.X, pady=10)
+        ttk.Label(frame, textvariable=self.batch_summary_var).pack(anchor=tk.W)
+        
+        auto_frame = ttk.Frame(frame)
+        auto_frame.pack(fill=tk.X, pady=5)
+        ttk.Button(auto_frame, textvariable=self.auto_refresh_text,
+                  command=self.toggle_auto_refresh).pack(side=tk.LEFT, padx=5)
+        ttk.Label(auto_frame, text="Keeps the cities above current; City=seconds sets a city's "
+                                   "refresh interval").pack(side=tk.LEFT, padx=5)
+        
+        # Results table (click a heading to sort; Time sorts slowest first)
+        view_frame = ttk.Frame(frame)
+        view_frame.pack(fill=tk.X)
+        ttk.Checkbutton(view_frame, text="Failures only", variable=self.failures_only_var,
+                       command=lambda: self.results_tree.set_failures_only(self.failures_only_var.get())
+                       ).pack(side=tk.LEFT, padx=5)
+        
+        self.results_tree = VirtualTable(frame, self.results, {
+            'City': 'City', 'Temp': 'Temp (°C)', 'Weather': 'Weather', 'Time': 'Time (s)', 'Method': 'Method'
+        })
+        self.results_tree.set_failures_only(self.failures_only_var.get())
+        self.results_tree.pack(fill=tk.BOTH, expand=True)
+        
+        # Back button
+        ttk.Button(frame, text="Back to Home", command=self.create_home_page).pack(pady=10)
+
+    def create_forecast_page(self):
+        self.clear_frame()
+        
+        frame = ttk.Frame(self.root, padding="20")
+        frame.pack(fill=tk.BOTH, expand=True)
+        
+        # Input frame
+        input_frame = ttk.Frame(frame)
+        input_frame.pack(fill=tk.X, pady=10)
+        
+        ttk.Label(input_frame, text="Cities (comma separated):").pack(side=tk.LEFT)
+        self.forecast_entry = ttk.Entry(input_frame, width=50)
+        self.forecast_entry.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+        self.forecast_entry.insert(0, ", ".join(self.DEFAULT_CITIES))
+        ttk.Button(input_frame, text="Load File...", command=self.load_forecast_cities).pack(side=tk.LEFT, padx=5)
+        ttk.Button(input_frame, text="Fetch Forecasts", command=self.forecast_fetch).pack(side=tk.LEFT, padx=5)
         
         # Progress bar
         self.progress = ttk.Progressbar(frame, orient=tk.HORIZONTAL, mode='determinate')
         self.progress.pack(fill=tk.X, pady=10)
         
-        # Results treeview
-        self.results_tree = ttk.Treeview(frame, columns=('City', 'Temp', 'Weather', 'Time', 'Method'), show='headings')
-        self.results_tree.heading('City', text='City')
-        self.results_tree.heading('Temp', text='Temp (°C)')
-        self.results_tree.heading('Weather', text='Weather')
-        self.results_tree.heading('Time', text='Time (s)')
-        self.results_tree.heading('Method', text='Method')
+        # Per-city results share the batch page's row plumbing
+        results_frame = ttk.Frame(frame)
+        results_frame.pack(fill=tk.X)
+        self.results_tree = VirtualTable(results_frame, self.results, {
+            'City': 'City', 'Temp': 'Temp Range (°C)', 'Weather': 'Forecast', 'Time': 'Time (s)', 'Method': 'Method'
+        }, height=8)
+        self.results_tree.pack(fill=tk.BOTH, expand=True)
         
-        # Add scrollbar
-        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self.results_tree.yview)
-        self.results_tree.configure(yscroll=scrollbar.set)
-        self.results_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        # Aggregates are drawn here once the batch finishes
+        self.forecast_frame = ttk.Frame(frame)
+        self.forecast_frame.pack(fill=tk.BOTH, expand=True, pady=10)
         
         # Back button
         ttk.Button(frame, text="Back to Home", command=self.create_home_page).pack(pady=10)
 
-    def fetch_weather_sync(self, city):
+    def load_forecast_cities(self):
+        path = filedialog.askopenfilename(
+            title="Load cities from",
+            filetypes=[("City lists", "*.csv *.txt"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+        try:
+            cities = [city for city, _ in iter_city_file(path)]
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not read cities: {e}")
+            return
+        self.forecast_entry.delete(0, tk.END)
+        self.forecast_entry.insert(0, ", ".join(cities))
+
+    def forecast_fetch(self):
+        cities = list(dict.fromkeys(city.strip() for city in self.forecast_entry.get().split(",") if city.strip()))
+        if not cities:
+            messagebox.showerror("Error", "Please enter at least one city")
+            return
+        
+        self.reset_batch_view(len(cities))
+        for child in self.forecast_frame.winfo_children():
+            child.destroy()
+        _, deadline = self.request_budget("forecast")
+        self.submit_async(self.async_forecast_batch(cities, self.create_scheduler(), deadline))
+
+    def show_forecast_summary(self, forecast):
+        for child in self.forecast_frame.winfo_children():
+            child.destroy()
+        if not forecast.cities:
+            ttk.Label(self.forecast_frame, text="No forecasts were fetched.").pack(pady=20)
+            return
+        
+        hottest = forecast.top_k(self.FORECAST_TOP_K)
+        anomaly = forecast.anomaly()
+        peaks = np.nanmax(forecast.variable("temp"), axis=0)
+        mean_anomaly = np.nanmean(anomaly, axis=0)
+        
+        # Hottest cities
+        top_frame = ttk.LabelFrame(self.forecast_frame, text=f"Top {len(hottest)} Hottest", padding="10")
+        top_frame.pack(side=tk.LEFT, fill=tk.Y, padx=5)
+        top_tree = ttk.Treeview(top_frame, columns=('City', 'Peak', 'Anomaly'), show='headings', height=10)
+        top_tree.heading('City', text='City')
+        top_tree.heading('Peak', text='Peak (°C)')
+        top_tree.heading('Anomaly', text='vs Batch (°C)')
+        for column in ('Peak', 'Anomaly'):
+            top_tree.column(column, width=90, anchor=tk.E)
+        for i in hottest:
+            top_tree.insert('', tk.END, values=(forecast.cities[i], f"{peaks[i]:.1f}", f"{mean_anomaly[i]:+.1f}"))
+        top_tree.pack(fill=tk.BOTH, expand=True)
+        
+        fig = Figure(figsize=(9, 4), dpi=80)
+        daily_plot = fig.add_subplot(121)
+        anomaly_plot = fig.add_subplot(122)
+        
+        # Batch-wide daily range and mean of the per-city daily means
+        day_starts, daily_min, daily_max, daily_mean = forecast.daily()
+        days = np.arange(len(day_starts))
+        labels = [time.strftime("%a %d", time.gmtime(day)) for day in day_starts]
+        daily_plot.fill_between(days, np.nanmin(daily_min, axis=1), np.nanmax(daily_max, axis=1),
+                                color="orange", alpha=0.3, label="Min-max across cities")
+        daily_plot.plot(days, np.nanmean(daily_mean, axis=1), color="firebrick", marker="o", label="Mean")
+        daily_plot.set_xticks(days)
+        daily_plot.set_xticklabels(labels, fontsize=8)
+        daily_plot.set_title(f"Daily Temperature ({len(forecast.cities)} cities, UTC days)")
+        daily_plot.set_ylabel("°C")
+        daily_plot.legend(fontsize=8)
+        
+        # Hottest cities against the batch mean over time
+        hours = (forecast.times - forecast.times[0]) / 3600
+        shown = anomaly[:, hottest].T
+        limit = float(np.nanmax(np.abs(shown))) or 1.0  # centre the colour scale on the batch mean
+        image = anomaly_plot.imshow(shown, aspect="auto", cmap="coolwarm", interpolation="nearest",
+                                    vmin=-limit, vmax=limit,
+                                    extent=(hours[0], hours[-1] if len(hours) > 1 else 1, len(hottest) - 0.5, -0.5))
+        anomaly_plot.set_yticks(np.arange(len(hottest)))
+        anomaly_plot.set_yticklabels([forecast.cities[i] for i in hottest], fontsize=8)
+        anomaly_plot.set_xlabel("Hours ahead")
+        anomaly_plot.set_title("Anomaly vs Batch Mean (°C)")
+        fig.colorbar(image, ax=anomaly_plot)
+        fig.tight_layout()
+        
+        canvas = FigureCanvasTkAgg(fig, master=self.forecast_frame)
+        canvas.draw()
+        canvas.get_tk_widget().pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+    def fetch_weather_sync(self, city, text_widget=None):
         if not city:
             messagebox.showerror("Error", "Please enter a city name")
             return
         
+        text_widget = text_widget or self.sync_text
+        use_cache = not self.bypass_cache_var.get()
         self.status_var.set(f"Fetching weather for {city} (Synchronous)...")
-        self.root.update()
         
-        start_time = time.time()
+        if self.blocking_demo_var.get():
+            # Deliberately freeze the UI while the request runs
+            self.root.update()
+            self.run_sync_fetch(city, text_widget, use_cache)
+        else:
+            self.sync_worker.submit(self.run_sync_fetch, city, text_widget, use_cache)
+
+    def run_sync_fetch(self, city, text_widget, use_cache=True):
+        start_time = time.perf_counter()
         
         try:
-            response = requests.get(
-                self.WEATHER_URL,
-                params={"q": city, "appid": self.API_KEY, "units": "metric"},
-                timeout=10
-            )
-            data = response.json()
+            phases = {}
+            status, data, source = self.sync_request(city, use_cache, phases=phases)
+            elapsed = time.perf_counter() - start_time
+            if source in UPSTREAM_SOURCES:
+                self.metrics.record("sync", city, elapsed, status, start=start_time, phases=phases)
             
-            if response.status_code != 200:
-                self.update_results(self.sync_text, f"Error: {data.get('message', 'Unknown error')}")
+            if status != 200:
+                self.post_text(text_widget, f"Error: {data.get('message', 'Unknown error')}")
                 return
-                
-            elapsed = time.time() - start_time
-            self.sync_times.append(elapsed)
-            self.sync_success += 1
-            self.request_history.append(("sync", city, elapsed))
             
+            phase_text = f"Phases: {format_phases(phases)}\n" if source in UPSTREAM_SOURCES else ""
             result_text = (
                 f"City: {city}\n"
-                f"Temperature: {data['main']['temp']}°C\n"
-                f"Weather: {data['weather'][0]['description'].title()}\n"
-                f"Humidity: {data['main']['humidity']}%\n"
-                f"Wind: {data['wind']['speed']} m/s\n"
-                f"Time taken: {elapsed:.3f} seconds\n"
+                f"Temperature: {data.temp}°C\n"
+                f"Weather: {data.description.title()}\n"
+                f"Humidity: {data.humidity}%\n"
+                f"Wind: {data.wind_speed} m/s\n"
+                f"Time taken: {elapsed:.3f} seconds{'' if source == 'network' else f' ({source})'}\n"
+                f"{phase_text}"
 				f"---------------------------------------------\n"
             )
             
-            self.update_results(self.sync_text, result_text)
+            self.post_text(text_widget, result_text)
             
         except Exception as e:
-            self.update_results(self.sync_text, f"Error: {str(e)}")
+            self.post_text(text_widget, f"Error: {str(e)}")
         finally:
-            self.status_var.set(f"Completed synchronous request for {city}")
+            self.post_status(f"Completed synchronous request for {city}")
 
-    def fetch_weather_async(self, city):
+    def fetch_weather_async(self, city, text_widget=None):
         if not city:
             messagebox.showerror("Error", "Please enter a city name")
             return
         
         self.status_var.set(f"Fetching weather for {city} (Asynchronous)...")
-        
-        threading.Thread(
-            target=self.run_async_fetch,
-            args=(city,),
-            daemon=True
-        ).start()
+        self.run_async_fetch(city, text_widget or self.async_text, use_cache=not self.bypass_cache_var.get())
 
-    def run_async_fetch(self, city):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(self.async_fetch_weather(city))
-        finally:
-            loop.close()
+    def run_async_fetch(self, city, text_widget, use_cache=True):
+        return self.submit_async(self.async_fetch_weather(city, text_widget, use_cache))
 
-    async def async_fetch_weather(self, city):
-        start_time = time.time()
+    async def async_fetch_weather(self, city, text_widget, use_cache=True):
+        start_time = time.perf_counter()
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    self.WEATHER_URL,
-                    params={"q": city, "appid": self.API_KEY, "units": "metric"},
-                    timeout=10
-                ) as response:
-                    data = await response.json()
-                    
-                    if response.status != 200:
-                        self.root.after(0, self.update_results,
-                                      self.async_text,
-                                      f"Error: {data.get('message', 'Unknown error')}")
-                        return
-                        
-                    elapsed = time.time() - start_time
-                    self.async_times.append(elapsed)
-                    self.async_success += 1
-                    self.request_history.append(("async", city, elapsed))
-                    
-                    result_text = (
-                        f"City: {city}\n"
-                        f"Temperature: {data['main']['temp']}°C\n"
-                        f"Weather: {data['weather'][0]['description'].title()}\n"
-                        f"Humidity: {data['main']['humidity']}%\n"
-                        f"Wind: {data['wind']['speed']} m/s\n"
-                        f"Time taken: {elapsed:.3f} seconds\n"
-						f"-------------------------------------\n"
-                    )
-                    
-                    self.root.after(0, self.update_results,
-                                  self.async_text,
-                                  result_text)
+            session = await self.get_session()
+            phases = {}
+            status, data, source = await self.async_request(session, city, use_cache, phases=phases)
+            elapsed = time.perf_counter() - start_time
+            if source in UPSTREAM_SOURCES:
+                self.metrics.record("async", city, elapsed, status, start=start_time, phases=phases)
+            
+            if status != 200:
+                self.post_text(text_widget, f"Error: {data.get('message', 'Unknown error')}")
+                return
+            
+            phase_text = f"Phases: {format_phases(phases)}\n" if source in UPSTREAM_SOURCES else ""
+            result_text = (
+                f"City: {city}\n"
+                f"Temperature: {data.temp}°C\n"
+                f"Weather: {data.description.title()}\n"
+                f"Humidity: {data.humidity}%\n"
+                f"Wind: {data.wind_speed} m/s\n"
+                f"Time taken: {elapsed:.3f} seconds{'' if source == 'network' else f' ({source})'}\n"
+                f"{phase_text}"
+				f"-------------------------------------\n"
+            )
+            
+            self.post_text(text_widget, result_text)
                     
         except Exception as e:
-            self.root.after(0, self.update_results,
-                          self.async_text,
-                          f"Error: {str(e)}")
+            self.post_text(text_widget, f"Error: {str(e)}")
         finally:
-            self.root.after(0, lambda: self.status_var.set(f"Completed async request for {city}"))
+            self.post_status(f"Completed async request for {city}")
 
-    def batch_fetch(self, sync=True):
+    def batch_fetch(self, mode="sync"):
         cities = [city.strip() for city in self.cities_entry.get().split(",") if city.strip()]
         if not cities:
             messagebox.showerror("Error", "Please enter at least one city")
             return
+        if mode == "process" and self.recorder is not None:
+            # Workers can't share the recording file, so their traffic would go unrecorded
+            messagebox.showerror("Error", "Process pool batches can't be recorded. "
+                                          "Stop recording (Traffic menu) or pick another strategy.")
+            return
+        
+        self.reset_batch_view(len(cities))
+        
+        use_cache = not self.bypass_cache_var.get()
+        hedge_after, deadline = self.request_budget(mode)
+        if mode == "sync" and self.blocking_demo_var.get():
+            # Deliberately run on the Tk thread; results only appear once it finishes
+            self.run_sync_batch(cities, use_cache, deadline)
+        elif mode == "sync":
+            self.sync_worker.submit(self.run_sync_batch, cities, use_cache, deadline)
+        elif mode == "group":
+            self.run_group_batch(cities, use_cache, self.create_scheduler(), deadline)
+        elif mode in ("threaded", "process"):
+            workers = self.thread_workers_var.get() if mode == "threaded" else self.PROCESS_WORKERS
+            if workers < 1:
+                messagebox.showerror("Error", "Number of workers must be at least 1")
+                return
+            threading.Thread(target=self.run_executor_batch,
+                             args=(cities, mode, workers, use_cache, deadline), daemon=True).start()
+        else:
+            self.run_async_batch(cities, use_cache, self.create_scheduler(), hedge_after, deadline)
+
+    def toggle_auto_refresh(self):
+        if self.auto_refresh is not None:
+            self.auto_refresh.cancel()
+            self.auto_refresh = None
+            self.auto_refresh_text.set("Start Auto-Refresh")
+            self.status_var.set("Auto-refresh stopped")
+            return
         
-        self.progress["maximum"] = len(cities)
+        # "City" uses the default interval, "City=120" refreshes every 120 seconds
+        intervals = {}
+        try:
+            for part in self.cities_entry.get().split(","):
+                city, _, interval = part.partition("=")
+                if city.strip():
+                    intervals[city.strip()] = float(interval) if interval.strip() else None
+        except ValueError:
+            messagebox.showerror("Error", "Refresh intervals must be numbers of seconds (City=120)")
+            return
+        if not intervals:
+            messagebox.showerror("Error", "Please enter at least one city")
+            return
+        
+        # The first round is spread over the rate limit so it doesn't start out behind
+        schedule = RefreshSchedule(self.AUTO_REFRESH_INTERVAL, self.AUTO_REFRESH_JITTER, self.AUTO_REFRESH_GRACE)
+        rate_per_minute = self.rate_limit_var.get()
+        spacing = 60 / rate_per_minute if rate_per_minute > 0 else 0.0
+        now = time.time()
+        for i, (city, interval) in enumerate(intervals.items()):
+            schedule.add(city, interval, due=now + i * spacing)
+        
+        self.reset_batch_view(len(intervals))
+        self.refresh_schedule = schedule
+        # The engine takes rate-limit tokens itself, before popping a city, so lateness is
+        # measured against when a request can actually go out
+        self.auto_refresh = self.submit_async(
+            self.async_auto_refresh(schedule, self.create_scheduler(paced=False), self.rate_bucket()))
+        self.auto_refresh_text.set("Stop Auto-Refresh")
+
+    async def async_auto_refresh(self, schedule, scheduler=None, bucket=None):
+        # Polling engine: starts each city's refresh as it falls due, paced by `bucket`.
+        # Changed rows are collected and sent to the table in one update per tick;
+        # conditional requests that come back unchanged only reschedule the city
+        updates = {}
+        tasks = set()
+        
+        async def refresh(session, city):
+            row, outcome = await self.async_fetch_row(session, city, False, scheduler, track_changes=True)
+            now = time.time()
+            if outcome != "unchanged":
+                updates[city] = row
+            if outcome == "failed":
+                schedule.completed(city, False, now, now + self.UPSTREAM_RETRY)
+            else:
+                schedule.completed(city, True, now, self.changes.next_refresh(self.cache_key(city), now))
+        
+        async def publish():
+            while True:
+                await asyncio.sleep(self.AUTO_REFRESH_TICK)
+                if updates:
+                    self.ui_queue.put(("refresh", list(updates.values())))
+                    updates.clear()
+                self.ui_queue.put(("summary", f"Auto-refresh: {schedule.summary()}"))
+                self.ui_queue.put(("progress", len(schedule.refreshed_at)))
+        
+        publisher = asyncio.create_task(publish())
+        try:
+            while True:
+                # Sleeps are capped at a tick so cities rescheduled sooner are picked up promptly
+                due = schedule.next_due()
+                wait = self.AUTO_REFRESH_TICK if due is None else due - time.time()
+                if wait > 0:
+                    await asyncio.sleep(min(wait, self.AUTO_REFRESH_TICK))
+                    continue
+                
+                if bucket is not None:
+                    await bucket.acquire()
+                city = schedule.pop()
+                session = await self.get_session()
+                task = asyncio.create_task(refresh(session, city))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            publisher.cancel()
+            for task in tasks:
+                task.cancel()
+
+    def reset_batch_view(self, maximum):
+        self.progress["maximum"] = maximum
         self.progress["value"] = 0
+        self.batch_summary_var.set("")
         
         # Clear previous results
-        for item in self.results_tree.get_children():
-            self.results_tree.delete(item)
+        self.results.clear()
+        self.results_tree.render()
+
+    def stream_file_batch(self):
+        input_path = filedialog.askopenfilename(
+            title="Stream cities from",
+            filetypes=[("City lists", "*.csv *.txt"), ("All files", "*.*")]
+        )
+        if not input_path:
+            return
+        output_path = filedialog.asksaveasfilename(
+            title="Write results to",
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl")]
+        )
+        if not output_path:
+            return
         
-        if sync:
-            self.run_sync_batch(cities)
-        else:
-            threading.Thread(target=self.run_async_batch, args=(cities,), daemon=True).start()
+        try:
+            size = os.path.getsize(input_path)
+            writer = ResultWriter(output_path)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not start streaming batch: {e}")
+            return
+        
+        # Progress is tracked in bytes of the input file, so the city count never has to be known
+        self.reset_batch_view(max(size, 1))
+        use_cache = not self.bypass_cache_var.get()
+        hedge_after, _ = self.request_budget("async")
+        self.submit_async(self.async_stream_batch(input_path, writer, use_cache, self.create_scheduler(), hedge_after))
 
-    def run_sync_batch(self, cities):
+    async def async_stream_batch(self, input_path, writer, use_cache=True, scheduler=None, hedge_after=None):
+        # Bounded producer/consumer pipeline: the file is read a chunk at a time off the loop into a
+        # small queue, workers fetch from it and every result goes straight to the writer
         total_start = time.time()
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue(maxsize=self.STREAM_QUEUE_SIZE)
+        counts = dict.fromkeys(("network", "unchanged", "cache", "coalesced", "failed"), 0)
+        done = 0
+        offset = 0
+        
+        async def produce():
+            reader = iter_city_file(input_path)
+            while True:
+                chunk = await loop.run_in_executor(None, list, itertools.islice(reader, self.STREAM_READ_CHUNK))
+                if not chunk:
+                    break
+                for item in chunk:
+                    await pending.put(item)
+            for _ in range(self.STREAM_WORKERS):
+                await pending.put(None)
+        
+        async def consume(session):
+            nonlocal done, offset
+            while True:
+                item = await pending.get()
+                if item is None:
+                    return
+                city, position = item
+                row, outcome = await self.async_fetch_row(session, city, use_cache, scheduler, hedge_after)
+                writer.write(row)
+                self.post_row(row)
+                counts[outcome] += 1
+                done += 1
+                offset = max(offset, position)
+                self.ui_queue.put(("progress", offset))
+                self.ui_queue.put(("summary", (
+                    f"{done} done: {counts['network']} fetched, {counts['unchanged']} unchanged, {counts['cache']} cached, "
+                    f"{counts['coalesced']} coalesced, {counts['failed']} failed")))
+        
+        session = await self.get_session()
+        consumers = [asyncio.create_task(consume(session)) for _ in range(self.STREAM_WORKERS)]
+        try:
+            await produce()
+            await asyncio.gather(*consumers)
+        except OSError as e:
+            self.post_status(f"Streaming batch stopped: {e}")
+            return
+        finally:
+            for task in consumers:
+                task.cancel()
+            await loop.run_in_executor(None, writer.close)
+        
+        total_elapsed = time.time() - total_start
+        self.post_status(
+            f"Streamed {done} cities in {total_elapsed:.2f} seconds; "
+            f"{writer.rows_written} results written to {os.path.basename(writer.path)}")
+
+    def request_budget(self, mode):
+        # (hedge delay, batch deadline) in seconds for a strategy; None disables either
+        if not self.budgets_var.get():
+            return None, None
+        
+        hedge_after = None
+        percentile = self.HEDGE_PERCENTILES.get(mode)
+        if percentile is not None:
+            recent = self.metrics.snapshot().recent_latencies(mode, self.HEDGE_WINDOW, exclude_queue=True)
+            if len(recent) >= self.HEDGE_MIN_SAMPLES:
+                hedge_after = float(np.percentile(recent, percentile))
+        return hedge_after, self.BATCH_DEADLINES.get(mode)
+
+    def report_timed_out(self, strategy, cities, start_time, progress, record_as=None):
+        # Rows and failure records for requests abandoned at the batch deadline
+        label = dict((key, name) for key, name, _ in self.STRATEGIES)[strategy]
+        elapsed = time.perf_counter() - start_time
+        if record_as is not None:
+            self.metrics.record(strategy, record_as, elapsed, 0, start=start_time)
+        for city in cities:
+            if record_as is None:
+                self.metrics.record(strategy, city, elapsed, 0, start=start_time)
+            self.post_row((city, "N/A", "Deadline exceeded", f"{elapsed:.3f}", f"{label} (Timed Out)"))
+            progress()
+
+    def run_sync_batch(self, cities, use_cache=True, deadline=None):
+        total_start = time.time()
+        deadline_start = time.perf_counter()
         
         for i, city in enumerate(cities, 1):
-            start_time = time.time()
+            if deadline is not None and time.perf_counter() - deadline_start > deadline:
+                # Requests run one at a time, so the deadline stops the rest from starting
+                progress = itertools.count(i)
+                self.report_timed_out("sync", cities[i - 1:], deadline_start,
+                                      lambda: self.report_progress(next(progress), len(cities), "synchronously"))
+                break
+            
+            start_time = time.perf_counter()
             try:
-                response = requests.get(
-                    self.WEATHER_URL,
-                    params={"q": city, "appid": self.API_KEY, "units": "metric"},
-                    timeout=10
-                )
-                data = response.json()
+                phases = {}
+                status, data, source = self.sync_request(city, use_cache, phases)
                 
-                elapsed = time.time() - start_time
+                elapsed = time.perf_counter() - start_time
+                if source in UPSTREAM_SOURCES:
+                    self.metrics.record("sync", city, elapsed, status, start=start_time, phases=phases)
                 
-                if response.status_code == 200:
-                    self.sync_times.append(elapsed)
-                    self.sync_success += 1
-                    self.request_history.append(("sync", city, elapsed))
-                    
-                    self.root.after(0, self.add_to_results_tree,
-                                   (city, data['main']['temp'], 
-                                    data['weather'][0]['description'].title(),
-                                    f"{elapsed:.3f}", "Sync"))
+                if status == 200:
+                    self.post_row((city, data.temp, data.description.title(),
+                                   f"{elapsed:.3f}", "Sync" if source == "network" else f"Sync ({source.title()})"))
                 else:
-                    self.root.after(0, self.add_to_results_tree,
-                                   (city, "N/A", data.get('message', 'Error'), 
-                                    f"{elapsed:.3f}", "Sync (Failed)"))
+                    self.post_row((city, "N/A", data.get('message', 'Error'),
+                                   f"{elapsed:.3f}", "Sync (Failed)"))
                 
             except Exception as e:
-                elapsed = time.time() - start_time
-                self.root.after(0, self.add_to_results_tree,
-                               (city, "N/A", str(e), f"{elapsed:.3f}", "Sync (Failed)"))
+                elapsed = time.perf_counter() - start_time
+                self.metrics.record("sync", city, elapsed, 0, start=start_time)
+                self.post_row((city, "N/A", str(e), f"{elapsed:.3f}", "Sync (Failed)"))
+            
+            self.report_progress(i, len(cities), "synchronously")
+        
+        total_elapsed = time.time() - total_start
+        self.post_status(
+            f"Completed batch sync for {len(cities)} cities in {total_elapsed:.2f} seconds")
+
+    def get_process_pool(self):
+        if self.process_pool is None:
+            # Spawned workers don't inherit the Tk interpreter, the asyncio loop or held locks
+            self.process_pool = ProcessPoolExecutor(
+                max_workers=self.PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_process_worker,
+                initargs=(self.replay.path, self.replay.scale) if self.replay is not None else ()
+            )
+        return self.process_pool
+
+    def timed_sync_request(self, city, http=None):
+        # Same result shape as process_fetch_city
+        start_time = time.perf_counter()
+        phases = {}
+        status, data, _ = self.sync_request(city, use_cache=False, phases=phases, http=http)
+        return status, data, time.perf_counter() - start_time, phases
+
+    def run_executor_batch(self, cities, mode, workers, use_cache=True, deadline=None):
+        # Runs on its own coordinator thread so the pools never block the Tk loop
+        label = dict((key, name) for key, name, _ in self.STRATEGIES)[mode]
+        total = len(cities)
+        done = itertools.count(1)
+        total_start = time.time()
+        deadline_start = time.perf_counter()
+        
+        if mode == "threaded":
+            # A session per batch with a connection pool as large as the worker count, so
+            # workers never wait on the shared session's smaller pool
+            executor = ThreadPoolExecutor(max_workers=workers)
+            http = self.create_http_session(workers)
+        else:
+            executor = self.get_process_pool()
+        
+        futures = {}
+        for city in cities:
+            if use_cache:
+                data = self.cache.get(self.cache_key(city))
+                if data is not None:
+                    self.post_row((city, data.temp, data.description.title(),
+                                   "0.000", f"{label} (Cache)"))
+                    self.report_progress(next(done), total, f"with the {label.lower()} pool")
+                    continue
             
-            self.root.after(0, lambda i=i: self.progress.config(value=i))
-            self.root.after(0, lambda: self.status_var.set(
-                f"Processed {i}/{len(cities)} cities synchronously"))
+            if mode == "threaded":
+                future = executor.submit(self.timed_sync_request, city, http)
+            else:
+                future = executor.submit(process_fetch_city, self.WEATHER_URL, self.API_KEY, self.UNITS, city)
+            futures[future] = city
+        
+        remaining = set(futures)
+        try:
+            for future in as_completed(futures, timeout=deadline):
+                remaining.discard(future)
+                self.handle_executor_result(future, futures[future], mode, label)
+                self.report_progress(next(done), total, f"with the {label.lower()} pool")
+        except FuturesTimeoutError:
+            # Queued work is cancelled; calls already running finish in the background and are ignored
+            for future in remaining:
+                future.cancel()
+            self.report_timed_out(mode, [futures[future] for future in remaining], deadline_start,
+                                  lambda: self.report_progress(next(done), total, f"with the {label.lower()} pool"))
+        
+        if mode == "threaded":
+            executor.shutdown(wait=False, cancel_futures=True)
+            http.close()
         
         total_elapsed = time.time() - total_start
-        self.root.after(0, lambda: self.status_var.set(
-            f"Completed batch sync for {len(cities)} cities in {total_elapsed:.2f} seconds"))
+        self.post_status(
+            f"Completed batch {mode} for {total} cities in {total_elapsed:.2f} seconds "
+            f"({workers} workers)")
 
-    def run_async_batch(self, cities):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+    def handle_executor_result(self, future, city, mode, label):
         try:
-            loop.run_until_complete(self.async_batch_fetch(cities))
-        finally:
-            loop.close()
+            status, data, elapsed, phases = future.result()
+            self.metrics.record(mode, city, elapsed, status, phases=phases)
+            
+            if status == 200:
+                if mode == "process":
+                    self.cache.put(self.cache_key(city), data)
+                    self.city_ids.learn(city, data.city_id)
+                
+                self.post_row((city, data.temp, data.description.title(), f"{elapsed:.3f}", label))
+            else:
+                self.post_row((city, "N/A", data.get('message', 'Error'),
+                               f"{elapsed:.3f}", f"{label} (Failed)"))
+                
+        except Exception as e:
+            self.post_row((city, "N/A", str(e), "N/A", f"{label} (Failed)"))
 
-    async def async_batch_fetch(self, cities):
+    def run_async_batch(self, cities, use_cache=True, scheduler=None, hedge_after=None, deadline=None):
+        return self.submit_async(self.async_batch_fetch(cities, use_cache, scheduler, hedge_after, deadline))
+
+    async def async_batch_fetch(self, cities, use_cache=True, scheduler=None, hedge_after=None, deadline=None):
         total_start = time.time()
-        tasks = []
+        deadline_start = time.perf_counter()
+        coalesced_before = self.single_flight.coalesced
+        hedges_before = self.hedges_sent, self.hedges_won
+        tasks = {}
         
-        async with aiohttp.ClientSession() as session:
-            for i, city in enumerate(cities, 1):
-                task = asyncio.create_task(self.async_fetch_city(session, city, i, len(cities)))
-                tasks.append(task)
+        done = itertools.count(1)
+        
+        session = await self.get_session()
+        for city in cities:
+            task = asyncio.create_task(self.async_fetch_city(
+                session, city, done, len(cities), use_cache, scheduler, hedge_after=hedge_after))
+            tasks[task] = [city]
+        
+        await self.await_batch(tasks, deadline, "async", deadline_start,
+                               lambda: self.report_progress(next(done), len(cities), "asynchronously"))
+        
+        total_elapsed = time.time() - total_start
+        coalesced = self.single_flight.coalesced - coalesced_before
+        wait_text = ""
+        if hedge_after is not None:
+            wait_text += (f", hedged after {hedge_after:.2f}s: {self.hedges_sent - hedges_before[0]} sent, "
+                          f"{self.hedges_won - hedges_before[1]} won")
+        if scheduler is not None:
+            wait_text += f", avg wait {scheduler.average_wait:.2f}s, max wait {scheduler.max_wait:.2f}s"
+            if isinstance(scheduler, AdaptiveScheduler):
+                wait_text += f", adaptive limit {scheduler.max_in_flight} (peak {scheduler.peak_limit})"
+        self.post_status(
+            f"Completed batch async for {len(cities)} cities in {total_elapsed:.2f} seconds "
+            f"({coalesced} coalesced{wait_text})")
+
+    async def await_batch(self, tasks, deadline, strategy, start_time, progress, record_as=None):
+        # Waits for a batch's tasks; at the deadline the stragglers are cancelled and reported as timed out
+        _, pending = await asyncio.wait(tasks, timeout=deadline)
+        if not pending:
+            return
+        
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in pending:
+            self.report_timed_out(strategy, tasks[task], start_time, progress,
+                                  record_as(tasks[task]) if record_as is not None else None)
+
+    async def async_fetch_city(self, session, city, done, total, use_cache=True, scheduler=None,
+                               how="asynchronously", hedge_after=None, strategy="async", label=None):
+        row, _ = await self.async_fetch_row(session, city, use_cache, scheduler, hedge_after, strategy, label)
+        self.post_row(row)
+        
+        queue_text = f" ({scheduler.queue_depth} queued)" if scheduler is not None else ""
+        self.report_progress(next(done), total, f"{how}{queue_text}")
+
+    async def async_fetch_row(self, session, city, use_cache=True, scheduler=None, hedge_after=None,
+                              strategy="async", label=None, track_changes=False):
+        # One async lookup as a results row, plus where it came from: "network", "cache",
+        # "coalesced" or "failed". It's recorded under `strategy`, and network rows are
+        # labelled `label` (the strategy's name by default)
+        start_time = time.perf_counter()
+        name = strategy.title()
+        
+        try:
+            phases = {}
+            status, data, source = await self.async_request(
+                session, city, use_cache, scheduler, phases, hedge_after, track_changes)
+            elapsed = time.perf_counter() - start_time
+            if source in UPSTREAM_SOURCES:
+                self.metrics.record(strategy, city, elapsed, status, start=start_time, phases=phases)
             
-            await asyncio.gather(*tasks)
+            if status == 200:
+                return (city, data.temp, data.description.title(), f"{elapsed:.3f}",
+                        (label or name) if source == "network" else f"{name} ({source.title()})"), source
+            return (city, "N/A", data.get('message', 'Error'), f"{elapsed:.3f}", f"{name} (Failed)"), "failed"
+        
+        except Exception as e:
+            elapsed = time.perf_counter() - start_time
+            self.metrics.record(strategy, city, elapsed, 0, start=start_time)
+            return (city, "N/A", str(e), f"{elapsed:.3f}", f"{name} (Failed)"), "failed"
+
+    def report_progress(self, current, total, how):
+        self.ui_queue.put(("progress", current))
+        self.post_status(f"Processed {current}/{total} cities {how}")
+
+    def run_group_batch(self, cities, use_cache=True, scheduler=None, deadline=None):
+        return self.submit_async(self.async_group_batch_fetch(cities, use_cache, scheduler, deadline))
+
+    async def async_group_batch_fetch(self, cities, use_cache=True, scheduler=None, deadline=None):
+        total_start = time.time()
+        deadline_start = time.perf_counter()
+        total = len(cities)
+        done = itertools.count(1)
+        
+        session = await self.get_session()
+        await asyncio.get_running_loop().run_in_executor(None, self.city_ids.load)
+        
+        # Resolve names to ids; duplicates share an id and unknown names fall back to single requests
+        grouped = {}
+        fallback = []
+        for city in cities:
+            if use_cache:
+                data = self.cache.get(self.cache_key(city))
+                if data is not None:
+                    self.post_row((city, data.temp, data.description.title(),
+                                   "0.000", "Group (Cache)"))
+                    self.report_progress(next(done), total, "using the group API")
+                    continue
+            
+            city_id = self.city_ids.lookup(city)
+            if city_id is None:
+                fallback.append(city)
+            else:
+                grouped.setdefault(city_id, []).append(city)
+        
+        entries = list(grouped.items())
+        chunks = [entries[i:i + self.GROUP_SIZE] for i in range(0, len(entries), self.GROUP_SIZE)]
+        tasks = {asyncio.create_task(self.async_fetch_group(session, chunk, done, total, scheduler)):
+                 [city for _, names in chunk for city in names] for chunk in chunks}
+        
+        tasks.update((asyncio.create_task(
+            self.async_fetch_city(session, city, done, total, use_cache, scheduler, "using the group API",
+                                  strategy="group", label="Group (Single)")), [city])
+            for city in fallback)
+        if tasks:
+            await self.await_batch(tasks, deadline, "group", deadline_start,
+                                   lambda: self.report_progress(next(done), total, "using the group API"),
+                                   lambda names: f"(group of {len(names)})" if len(names) > 1 else None)
         
         total_elapsed = time.time() - total_start
-        self.root.after(0, lambda: self.status_var.set(
-            f"Completed batch async for {len(cities)} cities in {total_elapsed:.2f} seconds"))
+        self.post_status(
+            f"Completed batch group for {total} cities in {total_elapsed:.2f} seconds "
+            f"({len(chunks)} group requests, {len(fallback)} single requests)")
 
-    async def async_fetch_city(self, session, city, current, total):
-        start_time = time.time()
+    async def async_fetch_group(self, session, chunk, done, total, scheduler=None):
+        start_time = time.perf_counter()
+        cities = [city for _, names in chunk for city in names]
         
         try:
-            async with session.get(
-                self.WEATHER_URL,
-                params={"q": city, "appid": self.API_KEY, "units": "metric"},
-                timeout=10
-            ) as response:
-                data = await response.json()
-                elapsed = time.time() - start_time
-                
-                if response.status == 200:
-                    self.async_times.append(elapsed)
-                    self.async_success += 1
-                    self.request_history.append(("async", city, elapsed))
-                    
-                    self.root.after(0, self.add_to_results_tree,
-                                  (city, data['main']['temp'], 
-                                   data['weather'][0]['description'].title(),
-                                   f"{elapsed:.3f}", "Async"))
-                else:
-                    self.root.after(0, self.add_to_results_tree,
-                                  (city, "N/A", data.get('message', 'Error'), 
-                                   f"{elapsed:.3f}", "Async (Failed)"))
+            phases = {}
+            status, data = await self.async_get_group(
+                session, [city_id for city_id, _ in chunk], scheduler, phases)
+            elapsed = time.perf_counter() - start_time
+            # Recorded under one name per chunk size rather than per chunk, so group requests
+            # don't keep adding names to the metrics
+            self.metrics.record("group", f"(group of {len(cities)})", elapsed, status,
+                                start=start_time, phases=phases)
+            
+            if status == 200:
+                # Split the group response back into one row per requested city
+                by_id = {item.city_id: item for item in data}
+                for city_id, names in chunk:
+                    item = by_id.get(city_id)
+                    for city in names:
+                        if item is None:
+                            self.post_row((city, "N/A", "Missing from group response",
+                                           f"{elapsed:.3f}", "Group (Failed)"))
+                            continue
+                        
+                        self.cache.put(self.cache_key(city), item)
+                        self.post_row((city, item.temp, item.description.title(),
+                                       f"{elapsed:.3f}", "Group"))
+            else:
+                for city in cities:
+                    self.post_row((city, "N/A", data.get('message', 'Error'),
+                                   f"{elapsed:.3f}", "Group (Failed)"))
                 
         except Exception as e:
-            elapsed = time.time() - start_time
-            self.root.after(0, self.add_to_results_tree,
-                          (city, "N/A", str(e), f"{elapsed:.3f}", "Async (Failed)"))
+            elapsed = time.perf_counter() - start_time
+            for city in cities:
+                self.post_row((city, "N/A", str(e), f"{elapsed:.3f}", "Group (Failed)"))
         
-        self.root.after(0, lambda i=current: self.progress.config(value=i))
-        self.root.after(0, lambda: self.status_var.set(
-            f"Processed {current}/{total} cities asynchronously"))
+        for _ in cities:
+            self.report_progress(next(done), total, "using the group API")
 
-    def add_to_results_tree(self, values):
-        self.results_tree.insert('', tk.END, values=values)
-        self.results_tree.yview_moveto(1)  # Auto-scroll to bottom
+    async def async_forecast_batch(self, cities, scheduler=None, deadline=None):
+        total_start = time.time()
+        deadline_start = time.perf_counter()
+        total = len(cities)
+        done = itertools.count(1)
+        results = {}
+        
+        session = await self.get_session()
+        tasks = {asyncio.create_task(self.async_fetch_forecast(session, city, done, total, results, scheduler)): [city]
+                 for city in cities}
+        await self.await_batch(tasks, deadline, "forecast", deadline_start,
+                               lambda: self.report_progress(next(done), total, "for forecasts"))
+        
+        fetched = [city for city in cities if city in results]
+        forecast = ForecastSeries(fetched, [results[city] for city in fetched])
+        self.ui_queue.put(("forecast", forecast))
+        
+        total_elapsed = time.time() - total_start
+        self.post_status(
+            f"Fetched forecasts for {len(fetched)}/{total} cities in {total_elapsed:.2f} seconds "
+            f"({len(forecast.times)} timestamps)")
+
+    async def async_fetch_forecast(self, session, city, done, total, results, scheduler=None):
+        start_time = time.perf_counter()
+        
+        try:
+            phases = {}
+            status, data = await self.async_get_forecast(session, city, scheduler, phases)
+            elapsed = time.perf_counter() - start_time
+            self.metrics.record("forecast", city, elapsed, status, start=start_time, phases=phases)
+            
+            if status == 200 and len(data[0]):
+                results[city] = data
+                temps = data[1][:, FORECAST_VARIABLES.index("temp")]
+                self.post_row((city, f"{temps.min():.1f} to {temps.max():.1f}", f"{len(data[0])} steps",
+                               f"{elapsed:.3f}", "Forecast"))
+            else:
+                message = data.get('message', 'Error') if isinstance(data, dict) else "Empty forecast"
+                self.post_row((city, "N/A", message, f"{elapsed:.3f}", "Forecast (Failed)"))
+        
+        except Exception as e:
+            elapsed = time.perf_counter() - start_time
+            self.metrics.record("forecast", city, elapsed, 0, start=start_time)
+            self.post_row((city, "N/A", str(e), f"{elapsed:.3f}", "Forecast (Failed)"))
+        
+        self.report_progress(next(done), total, "for forecasts")
+
+    def post_row(self, values):
+        self.ui_queue.put(("row", values))
+
+    def post_text(self, text_widget, content):
+        self.ui_queue.put(("text", text_widget, content))
+
+    def post_status(self, text):
+        self.ui_queue.put(("status", text))
+
+    def drain_ui_queue(self):
+        # Applies everything workers queued since the last frame in one pass. The next frame is
+        # scheduled first so an unexpected error here can't stop later updates from being drained
+        self.root.after(self.UI_FRAME_MS, self.drain_ui_queue)
+        progress = None
+        status = None
+        summary = None
+        forecast = None
+        rows = []
+        refreshed = {}
+        texts = {}
+        while True:
+            try:
+                event = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            
+            kind = event[0]
+            if kind == "row":
+                rows.append(event[1])
+            elif kind == "progress":
+                progress = event[1]
+            elif kind == "status":
+                status = event[1]
+            elif kind == "summary":
+                summary = event[1]
+            elif kind == "forecast":
+                forecast = event[1]
+            elif kind == "refresh":
+                refreshed.update((values[0], values) for values in event[1])
+            elif kind == "text":
+                texts.setdefault(event[1], []).append(event[2])
+        
+        # Rows go into the store whether or not a results table is showing; the table only
+        # redraws its visible rows, once per frame
+        self.results.extend(rows)
+        self.results.upsert(refreshed.values())
+        
+        try:
+            if rows or refreshed:
+                self.results_tree.render()
+            if progress is not None:
+                self.progress.config(value=progress)
+        except (AttributeError, tk.TclError):
+            pass  # The batch page isn't showing any more
+        
+        for text_widget, contents in texts.items():
+            try:
+                self.update_results(text_widget, "".join(contents))
+            except tk.TclError:
+                pass
+        
+        if status is not None:
+            self.status_var.set(status)
+        if summary is not None:
+            self.batch_summary_var.set(summary)
+        if forecast is not None:
+            try:
+                self.show_forecast_summary(forecast)
+            except (AttributeError, tk.TclError):
+                pass  # The forecast page isn't showing any more
 
     def show_performance_graphs(self):
         self.clear_frame()
+        metrics = self.metrics.snapshot()
         
         frame = ttk.Frame(self.root, padding="20")
         frame.pack(fill=tk.BOTH, expand=True)
         
-        if not self.sync_times and not self.async_times:
+        if not metrics.ok_counts.any():
             ttk.Label(frame, text="No performance data available yet. Make some requests first.").pack(pady=20)
             ttk.Button(frame, text="Back to Home", command=self.create_home_page).pack(pady=10)
             return
         
         # Create matplotlib figure
         fig = Figure(figsize=(10, 5), dpi=100)
-        plot = fig.add_subplot(111)
+        if len(self.limit_history) > 1:
+            plot = fig.add_subplot(121)
+            limit_plot = fig.add_subplot(122)
+            
+            # Adaptive limit chosen over time
+            limit_times, limits = np.array(self.limit_history).T
+            limit_plot.step(limit_times - limit_times[0], limits, where='post', color='red')
+            limit_plot.set_title('Adaptive Concurrency Limit')
+            limit_plot.set_xlabel('Time (seconds)')
+            limit_plot.set_ylabel('In-flight Limit')
+            limit_plot.grid(True)
+        else:
+            plot = fig.add_subplot(111)
         
-        if self.sync_times:
-            plot.plot(range(1, len(self.sync_times)+1), self.sync_times, 'r-', label='Synchronous', marker='o')
-        if self.async_times:
-            plot.plot(range(1, len(self.async_times)+1), self.async_times, 'b-', label='Asynchronous', marker='o')
+        for key, label, color in self.STRATEGIES:
+            times = metrics.successful_latencies(key)
+            if len(times):
+                plot.plot(np.arange(1, len(times) + 1), times, '-', color=color, label=label, marker='o')
         
         plot.set_title('Request Performance Comparison')
         plot.set_xlabel('Request Number')
@@ -485,64 +1776,106 @@ class WeatherComparisonApp:
         stats_frame = ttk.Frame(frame)
         stats_frame.pack(pady=10)
         
-        if self.sync_times:
-            ttk.Label(stats_frame, 
-                     text=f"Sync Avg: {np.mean(self.sync_times):.3f}s | "
-                          f"Min: {min(self.sync_times):.3f}s | "
-                          f"Max: {max(self.sync_times):.3f}s | "
-                          f"Total: {sum(self.sync_times):.2f}s").pack()
-        
-        if self.async_times:
-            ttk.Label(stats_frame, 
-                     text=f"Async Avg: {np.mean(self.async_times):.3f}s | "
-                          f"Min: {min(self.async_times):.3f}s | "
-                          f"Max: {max(self.async_times):.3f}s | "
-                          f"Total: {sum(self.async_times):.2f}s").pack()
+        for sid, (key, label, _) in enumerate(self.STRATEGIES):
+            if metrics.ok_counts[sid]:
+                ttk.Label(stats_frame, 
+                         text=f"{label} Avg: {metrics.mean(key):.3f}s | "
+                              f"Min: {metrics.mins[sid]:.3f}s | "
+                              f"Max: {metrics.maxs[sid]:.3f}s | "
+                              f"p99: {metrics.histograms[key].percentile(99):.3f}s | "
+                              f"Total: {metrics.sums[sid]:.2f}s").pack()
         
         ttk.Button(frame, text="Back to Home", command=self.create_home_page).pack(pady=10)
 
     def show_request_timeline(self):
         self.clear_frame()
+        metrics = self.metrics.snapshot()
         
         frame = ttk.Frame(self.root, padding="20")
         frame.pack(fill=tk.BOTH, expand=True)
         
-        if not self.request_history:
+        if not metrics.total:
             ttk.Label(frame, text="No request history available yet. Make some requests first.").pack(pady=20)
             ttk.Button(frame, text="Back to Home", command=self.create_home_page).pack(pady=10)
             return
         
         # Create matplotlib figure
-        fig = Figure(figsize=(10, 6), dpi=100)
-        plot = fig.add_subplot(111)
-        
-        # Prepare data for timeline
-        sync_times = []
-        async_times = []
-        
-        for i, (method, city, elapsed) in enumerate(self.request_history):
-            if method == "sync":
-                sync_times.append((i, elapsed, city))
-            else:
-                async_times.append((i, elapsed, city))
-        
-        if sync_times:
-            x, y, labels = zip(*sync_times)
-            plot.scatter(x, y, c='red', label='Synchronous', s=100)
-            for i, (xi, yi, label) in enumerate(zip(x, y, labels)):
-                plot.text(xi, yi, f" {label}", fontsize=8, va='center')
-        
-        if async_times:
-            x, y, labels = zip(*async_times)
-            plot.scatter(x, y, c='blue', label='Asynchronous', s=100)
-            for i, (xi, yi, label) in enumerate(zip(x, y, labels)):
-                plot.text(xi, yi, f" {label}", fontsize=8, va='center')
-        
-        plot.set_title('Request Timeline Visualization')
-        plot.set_xlabel('Request Sequence')
-        plot.set_ylabel('Time Taken (seconds)')
-        plot.legend()
-        plot.grid(True)
+        fig = Figure(figsize=(10, 8), dpi=100)
+        plot = fig.add_subplot(311)
+        flight_plot = fig.add_subplot(312, sharex=plot)
+        phase_plot = fig.add_subplot(313)
+        
+        # Prepare data for timeline (seconds since the oldest retained request)
+        strategy_ids = metrics.column("strategy_ids")
+        city_ids = metrics.column("city_ids")
+        latencies = metrics.column("latencies")
+        phases = metrics.column("phases")
+        origin = metrics.column("starts").min()
+        starts = metrics.column("starts") - origin
+        sent = starts + phases[:, PHASES.index("queue")]
+        ends = starts + latencies
+        sequence = np.arange(len(latencies))
+        
+        # Gantt bars: light for time spent queued, coloured while on the wire
+        step = max(1, -(-len(sequence) // self.TIMELINE_MAX_BARS))
+        rows = sequence[::step]
+        for sid, (key, strategy_label, color) in enumerate(self.STRATEGIES):
+            shown = rows[strategy_ids[rows] == sid]
+            if len(shown):
+                plot.hlines(shown, starts[shown], sent[shown], colors='lightgray', linewidth=3)
+                plot.hlines(shown, sent[shown], ends[shown], colors=color, linewidth=3, label=strategy_label)
+        
+        if len(rows) <= self.TIMELINE_LABEL_LIMIT:
+            plot.set_yticks(rows)
+            plot.set_yticklabels([metrics.city_names[city_id] for city_id in city_ids[rows]], fontsize=8)
+        plot.invert_yaxis()
+        
+        title = 'Request Timeline'
+        if step > 1:
+            title += f' (1 in {step} of {len(sequence)} requests shown)'
+        plot.set_title(title)
+        plot.set_ylabel('Request')
+        plot.legend(fontsize=8)
+        plot.grid(True, axis='x')
+        
+        # Achieved concurrency: +1 when a request goes on the wire, -1 when it completes
+        times = np.concatenate((sent, ends))
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        in_flight = np.cumsum(np.concatenate((np.ones(len(sent)), -np.ones(len(ends))))[order])
+        if len(times) > self.TIMELINE_MAX_POINTS:
+            # Keep the peak of each bucket so downsampling never hides a burst
+            edges = np.linspace(0, len(times), self.TIMELINE_MAX_POINTS, endpoint=False).astype(int)
+            times, in_flight = times[edges], np.maximum.reduceat(in_flight, edges)
+        
+        flight_plot.step(times, in_flight, where='post', color='black', label='In flight')
+        if self.requested_concurrency:
+            flight_plot.axhline(self.requested_concurrency, color='red', linestyle='--',
+                                label=f'Requested ({self.requested_concurrency})')
+        if self.limit_history:
+            limit_times, limits = np.array(self.limit_history).T
+            shown = limit_times >= origin
+            if shown.any():
+                flight_plot.step(limit_times[shown] - origin, limits[shown], where='post',
+                                 color='red', label='Adaptive limit')
+        flight_plot.set_xlabel('Time (seconds)')
+        flight_plot.set_ylabel('In-flight Requests')
+        flight_plot.legend(fontsize=8)
+        flight_plot.grid(True)
+        
+        # Stacked per-phase breakdown of the most recent requests
+        recent = slice(-self.TIMELINE_PHASE_REQUESTS, None)
+        bottom = np.zeros(len(phases[recent]))
+        for j, phase in enumerate(PHASES):
+            phase_plot.bar(sequence[recent], phases[recent, j], bottom=bottom, width=0.8,
+                           color=self.PHASE_COLORS[phase], label=phase)
+            bottom += phases[recent, j]
+        
+        phase_plot.set_xlabel('Request Sequence')
+        phase_plot.set_ylabel('Phase Time (seconds)')
+        phase_plot.legend(ncol=len(PHASES), fontsize=8)
+        phase_plot.grid(True, axis='y')
+        fig.tight_layout()
         
         # Embed plot in Tkinter
         canvas = FigureCanvasTkAgg(fig, master=frame)
@@ -553,6 +1886,7 @@ class WeatherComparisonApp:
 
     def show_stats_dashboard(self):
         self.clear_frame()
+        metrics = self.metrics.snapshot()
         
         frame = ttk.Frame(self.root, padding="20")
         frame.pack(fill=tk.BOTH, expand=True)
@@ -565,19 +1899,39 @@ class WeatherComparisonApp:
         summary_frame = ttk.LabelFrame(top_frame, text="Summary Statistics", padding="10")
         summary_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
         
-        stats = [
-            ("Total Requests", len(self.request_history)),
-            ("Sync Requests", len(self.sync_times)),
-            ("Async Requests", len(self.async_times)),
-            ("Sync Success Rate", f"{self.sync_success/len(self.sync_times)*100:.1f}%" if self.sync_times else "N/A"),
-            ("Async Success Rate", f"{self.async_success/len(self.async_times)*100:.1f}%" if self.async_times else "N/A"),
-            ("Fastest Request", f"{min(self.sync_times + self.async_times):.3f}s" if self.request_history else "N/A"),
-            ("Slowest Request", f"{max(self.sync_times + self.async_times):.3f}s" if self.request_history else "N/A")
+        fastest, slowest = metrics.fastest(), metrics.slowest()
+        stats = [("Total Requests", metrics.total)]
+        for key, label, _ in self.STRATEGIES:
+            stats.append((f"{label} Requests", metrics.count(key)))
+            stats.append((f"{label} Success Rate",
+                          f"{metrics.success_rate(key)*100:.1f}%" if metrics.count(key) else "N/A"))
+        stats += [
+            ("Fastest Request", f"{fastest:.3f}s" if fastest is not None else "N/A"),
+            ("Slowest Request", f"{slowest:.3f}s" if slowest is not None else "N/A"),
+            ("Cache Entries", f"{len(self.cache)}/{self.cache.max_entries}"),
+            ("Cache Hits", self.cache.hits),
+            ("Cache Misses", self.cache.misses),
+            ("Cache Evictions", self.cache.evictions),
+            ("Persistent Cache", f"{self.cache.disk_rows()} rows, {self.cache.disk_hits} disk hits"
+                                 if isinstance(self.cache, PersistentWeatherCache) else "Off"),
+            ("Upstream Async Calls", self.single_flight.calls),
+            ("Coalesced Requests", self.single_flight.coalesced),
+            ("Unchanged Responses", f"{self.changes.unchanged + self.changes.not_modified} "
+                                    f"({self.changes.not_modified} not modified)"),
+            ("Hedged Requests", f"{self.hedges_sent} ({self.hedges_won} won)"),
+            ("Auto-Refresh", self.refresh_schedule.summary() if self.auto_refresh is not None else "Off"),
+            ("JSON Decoder", JSON_BACKEND),
+            ("Metrics Lock Waits", metrics.contended),
+            ("Traffic", self.traffic_description()),
+            ("Cache Hit Rate", f"{self.cache.hits/(self.cache.hits + self.cache.misses)*100:.1f}%"
+                               if self.cache.hits + self.cache.misses else "N/A")
         ]
         
+        rows_per_column = 12
         for i, (label, value) in enumerate(stats):
-            ttk.Label(summary_frame, text=label, font=('Helvetica', 10, 'bold')).grid(row=i, column=0, sticky=tk.W, pady=2)
-            ttk.Label(summary_frame, text=value).grid(row=i, column=1, sticky=tk.W, pady=2)
+            row, column = i % rows_per_column, i // rows_per_column * 2
+            ttk.Label(summary_frame, text=label, font=('Helvetica', 10, 'bold')).grid(row=row, column=column, sticky=tk.W, pady=2, padx=(0, 5))
+            ttk.Label(summary_frame, text=value).grid(row=row, column=column + 1, sticky=tk.W, pady=2, padx=(0, 15))
         
         # Recent requests
         recent_frame = ttk.LabelFrame(top_frame, text="Recent Requests", padding="10")
@@ -591,34 +1945,54 @@ class WeatherComparisonApp:
         for item in recent_tree.get_children():
             recent_tree.delete(item)
         
-        for req in self.request_history[-10:]:  # Show last 10 requests
-            recent_tree.insert('', tk.END, values=(req[0].title(), req[1], f"{req[2]:.3f}"))
+        for method, city, elapsed, _ in metrics.recent(10):  # Show last 10 requests
+            recent_tree.insert('', tk.END, values=(method.title(), city, f"{elapsed:.3f}"))
         
         recent_tree.pack(fill=tk.BOTH, expand=True)
         
+        # Tail latency
+        percentile_frame = ttk.LabelFrame(top_frame, text="Latency Percentiles (s)", padding="10")
+        percentile_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
+        
+        columns = ('Method', 'Count', 'p50', 'p90', 'p99', 'p99.9')
+        percentile_tree = ttk.Treeview(percentile_frame, columns=columns, show='headings', height=5)
+        for column in columns:
+            percentile_tree.heading(column, text=column)
+            percentile_tree.column(column, width=60, anchor=tk.E if column != 'Method' else tk.W)
+        
+        for key, label, _ in self.STRATEGIES:
+            histogram = metrics.histograms[key]
+            if histogram.total:
+                percentile_tree.insert('', tk.END, values=(label, histogram.total, *(
+                    f"{value:.3f}" for value in histogram.percentiles().values())))
+        
+        percentile_tree.pack(fill=tk.BOTH, expand=True)
+        ttk.Button(percentile_frame, text="Export Histograms",
+                   command=self.export_histograms).pack(pady=(5, 0))
+        
         # Bottom frame for charts
         bottom_frame = ttk.Frame(frame)
         bottom_frame.pack(fill=tk.BOTH, expand=True, pady=10)
         
         # Small charts
-        if self.sync_times and self.async_times:
+        compared = [(label, key, color) for key, label, color in self.STRATEGIES if metrics.count(key)]
+        
+        if len(compared) >= 2:
             fig = Figure(figsize=(10, 4), dpi=80)
+            methods = [name for name, _, _ in compared]
+            colors = [color for _, _, color in compared]
             
             # Avg time comparison
             ax1 = fig.add_subplot(121)
-            methods = ['Sync', 'Async']
-            averages = [np.mean(self.sync_times), np.mean(self.async_times)]
-            ax1.bar(methods, averages, color=['red', 'blue'])
+            averages = [metrics.mean(key) for _, key, _ in compared]
+            ax1.bar(methods, averages, color=colors)
             ax1.set_title('Average Response Time')
             ax1.set_ylabel('Seconds')
             
             # Success rate comparison
             ax2 = fig.add_subplot(122)
-            success_rates = [
-                self.sync_success/len(self.sync_times)*100,
-                self.async_success/len(self.async_times)*100
-            ]
-            ax2.bar(methods, success_rates, color=['red', 'blue'])
+            success_rates = [metrics.success_rate(key)*100 for _, key, _ in compared]
+            ax2.bar(methods, success_rates, color=colors)
             ax2.set_title('Success Rate Comparison')
             ax2.set_ylabel('Percentage (%)')
             ax2.set_ylim(0, 100)
@@ -629,6 +2003,20 @@ class WeatherComparisonApp:
         
         ttk.Button(frame, text="Back to Home", command=self.create_home_page).pack(pady=10)
 
+    def export_histograms(self):
+        path = filedialog.asksaveasfilename(
+            title="Export latency histograms", defaultextension=".json",
+            initialfile="latency_histograms.json", filetypes=[("JSON", "*.json")])
+        if not path:
+            return
+        
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.metrics.export_histograms(), f)
+            self.status_var.set(f"Exported latency histograms to {path}")
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not export histograms: {e}")
+
     def test_ui_responsiveness(self):
         self.clear_frame()
         
@@ -650,6 +2038,8 @@ class WeatherComparisonApp:
                   command=lambda: self.fetch_during_test(sync=True)).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Fetch Async During Test", 
                   command=lambda: self.fetch_during_test(sync=False)).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(button_frame, text="Blocking demo",
+                       variable=self.blocking_demo_var).pack(side=tk.LEFT, padx=5)
         
         self.test_text = tk.Text(frame, height=10, state=tk.DISABLED)
         self.test_text.pack(fill=tk.BOTH, expand=True)
@@ -669,9 +2059,9 @@ class WeatherComparisonApp:
     def fetch_during_test(self, sync=True):
         city = "London"  # Default city for test
         if sync:
-            self.fetch_weather_sync(city)
+            self.fetch_weather_sync(city, self.test_text)
         else:
-            self.fetch_weather_async(city)
+            self.fetch_weather_async(city, self.test_text)
 
     def test_concurrency_limits(self):
         self.clear_frame()
@@ -688,13 +2078,62 @@ class WeatherComparisonApp:
         self.concurrency_var = tk.IntVar(value=10)
         ttk.Entry(input_frame, textvariable=self.concurrency_var, width=5).pack(side=tk.LEFT, padx=5)
         
+        ttk.Label(input_frame, text="Max in-flight (0 = unlimited):").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Entry(input_frame, textvariable=self.max_in_flight_var, width=5).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(input_frame, text="Adaptive (AIMD)",
+                       variable=self.adaptive_var).pack(side=tk.LEFT, padx=5)
+        
         ttk.Button(input_frame, text="Run Test", command=self.run_concurrency_test).pack(side=tk.LEFT, padx=10)
         
+        sweep_frame = ttk.Frame(frame)
+        sweep_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(sweep_frame, text="Sweep limits:").pack(side=tk.LEFT)
+        self.sweep_limits_var = tk.StringVar(value=", ".join(str(limit) for limit in self.SWEEP_LIMITS))
+        ttk.Entry(sweep_frame, textvariable=self.sweep_limits_var, width=30).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Button(sweep_frame, text="Sweep Limits", command=self.run_concurrency_sweep).pack(side=tk.LEFT, padx=10)
+        
         self.concurrency_text = tk.Text(frame, height=15, state=tk.DISABLED)
         self.concurrency_text.pack(fill=tk.BOTH, expand=True)
         
         ttk.Button(frame, text="Back to Home", command=self.create_home_page).pack(pady=10)
 
+    def rate_bucket(self):
+        # The app's one token bucket, shared by every batch, sweep, concurrency test and
+        # auto-refresh so together they stay within the rate limit; None when it's off.
+        # Changes to the limit are applied to the existing bucket
+        rate_per_minute = self.rate_limit_var.get()
+        if rate_per_minute <= 0:
+            return None
+        if self.upstream_bucket is None:
+            self.upstream_bucket = TokenBucket(rate_per_minute / 60, rate_per_minute)
+        else:
+            self.upstream_bucket.rate = rate_per_minute / 60
+            self.upstream_bucket.burst = rate_per_minute
+        return self.upstream_bucket
+
+    def create_scheduler(self, max_in_flight=None, adaptive=None, paced=True):
+        # Schedulers only bound in-flight requests; pacing comes from the shared rate_bucket()
+        # (paced=False leaves acquiring tokens to the caller)
+        if adaptive is None:
+            adaptive = self.adaptive_var.get()
+        if max_in_flight is None:
+            max_in_flight = self.max_in_flight_var.get()
+        bucket = self.rate_bucket() if paced else None
+        if adaptive:
+            # The adaptive limiter searches for the limit itself, up to ADAPTIVE_MAX_LIMIT
+            return AdaptiveScheduler(
+                initial_limit=self.ADAPTIVE_INITIAL_LIMIT,
+                min_limit=self.ADAPTIVE_MIN_LIMIT,
+                max_limit=self.ADAPTIVE_MAX_LIMIT,
+                backoff=self.ADAPTIVE_BACKOFF,
+                latency_tolerance=self.ADAPTIVE_LATENCY_TOLERANCE,
+                bucket=bucket,
+                history=self.limit_history
+            )
+        return BatchScheduler(max_in_flight=max_in_flight or None, bucket=bucket)
+
     def run_concurrency_test(self):
         num_requests = self.concurrency_var.get()
         if num_requests < 1:
@@ -703,65 +2142,117 @@ class WeatherComparisonApp:
         
         self.update_results(self.concurrency_text, f"Starting concurrency test with {num_requests} async requests...\n")
         
-        threading.Thread(
-            target=self.execute_concurrency_test,
-            args=(num_requests,),
-            daemon=True
-        ).start()
+        self.execute_concurrency_test(num_requests, self.create_scheduler())
 
-    def execute_concurrency_test(self, num_requests):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(self.run_async_concurrency_test(num_requests))
-        finally:
-            loop.close()
+    def execute_concurrency_test(self, num_requests, scheduler=None):
+        return self.submit_async(self.run_async_concurrency_test(num_requests, scheduler))
 
-    async def run_async_concurrency_test(self, num_requests):
+    async def run_async_concurrency_test(self, num_requests, scheduler=None, verbose=True):
         cities = [f"TestCity{i}" for i in range(1, num_requests+1)]
-        start_time = time.time()
+        start_time = time.perf_counter()
+        if isinstance(scheduler, AdaptiveScheduler):
+            self.requested_concurrency = None  # the timeline plots the adaptive limit instead
+        else:
+            self.requested_concurrency = (scheduler.max_in_flight if scheduler and scheduler.max_in_flight
+                                          else num_requests)
         
-        async with aiohttp.ClientSession() as session:
-            tasks = []
-            for city in cities:
-                task = asyncio.create_task(self.test_async_request(session, city))
-                tasks.append(task)
-            
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+        session = await self.get_session()
+        tasks = []
+        for city in cities:
+            if scheduler is not None:
+                task = asyncio.create_task(scheduler.run(
+                    lambda city=city: self.test_async_request(session, city, verbose)))
+            else:
+                task = asyncio.create_task(self.test_async_request(session, city, verbose))
+            tasks.append(task)
         
-        elapsed = time.time() - start_time
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        elapsed = time.perf_counter() - start_time
         
         success = sum(1 for r in results if not isinstance(r, Exception))
         
-        self.root.after(0, self.update_results,
-                      self.concurrency_text,
-                      f"\nCompleted {num_requests} async requests in {elapsed:.2f} seconds\n"
-                      f"Success rate: {success}/{num_requests} ({success/num_requests*100:.1f}%)\n"
-                      f"Average time per request: {elapsed/num_requests:.3f}s\n")
+        if verbose:
+            scheduler_text = ""
+            if scheduler is not None:
+                scheduler_text = (f"Average queue wait: {scheduler.average_wait:.3f}s "
+                                  f"(max {scheduler.max_wait:.3f}s)\n")
+                if isinstance(scheduler, AdaptiveScheduler):
+                    scheduler_text += (f"Adaptive limit: {scheduler.max_in_flight} "
+                                       f"(peak {scheduler.peak_limit}, {scheduler.cuts} cuts)\n")
+            self.post_text(self.concurrency_text,
+                           f"\nCompleted {num_requests} async requests in {elapsed:.2f} seconds\n"
+                           f"Success rate: {success}/{num_requests} ({success/num_requests*100:.1f}%)\n"
+                           f"Average time per request: {elapsed/num_requests:.3f}s\n"
+                           f"{scheduler_text}")
+        
+        return elapsed, success
+
+    def run_concurrency_sweep(self):
+        num_requests = self.concurrency_var.get()
+        if num_requests < 1:
+            messagebox.showerror("Error", "Number of requests must be at least 1")
+            return
+        
+        try:
+            limits = sorted({int(limit) for limit in self.sweep_limits_var.get().split(",") if limit.strip()})
+        except ValueError:
+            messagebox.showerror("Error", "Sweep limits must be comma separated integers")
+            return
+        if not limits or limits[0] < 1:
+            messagebox.showerror("Error", "Sweep limits must be at least 1")
+            return
+        
+        self.update_results(self.concurrency_text,
+                            f"Sweeping in-flight limits {limits} with {num_requests} requests each...\n")
+        schedulers = [self.create_scheduler(limit, adaptive=False) for limit in limits]
+        self.submit_async(self.run_async_concurrency_sweep(num_requests, schedulers))
+
+    async def run_async_concurrency_sweep(self, num_requests, schedulers):
+        throughputs = []
+        for scheduler in schedulers:
+            elapsed, success = await self.run_async_concurrency_test(num_requests, scheduler, verbose=False)
+            throughput = num_requests / elapsed if elapsed > 0 else 0.0
+            throughputs.append(throughput)
+            self.post_text(self.concurrency_text,
+                           f"Limit {scheduler.max_in_flight:>4}: {throughput:8.1f} req/s | "
+                           f"{success}/{num_requests} ok | "
+                           f"avg wait {scheduler.average_wait:.3f}s\n")
+        
+        # The knee is the last limit that still bought a meaningful throughput gain
+        knee = schedulers[0].max_in_flight
+        for i in range(1, len(schedulers)):
+            if throughputs[i] < throughputs[i - 1] * (1 + self.SWEEP_KNEE_GAIN):
+                break
+            knee = schedulers[i].max_in_flight
+        
+        self.post_text(self.concurrency_text, f"\nThroughput knee at ~{knee} in-flight requests\n")
 
-    async def test_async_request(self, session, city):
+    async def test_async_request(self, session, city, verbose=True):
+        start_time = time.perf_counter()
         try:
-            start_time = time.time()
+            phases = {}
             async with session.get(
                 self.WEATHER_URL,
                 params={"q": city, "appid": self.API_KEY, "units": "metric"},
-                timeout=10
+                timeout=10,
+                trace_request_ctx=phases
             ) as response:
-                await response.json()
-                elapsed = time.time() - start_time
+                await read_timed(response, phases)
+                elapsed = time.perf_counter() - start_time
+                self.metrics.record("concurrency", city, elapsed, response.status, start=start_time, phases=phases)
                 
-                self.root.after(0, self.update_results,
-                              self.concurrency_text,
-                              f"Request for {city}: {response.status} in {elapsed:.3f}s\n")
+                if verbose:
+                    self.post_text(self.concurrency_text,
+                                   f"Request for {city}: {response.status} in {elapsed:.3f}s "
+                                   f"({format_phases(phases)})\n")
                 
-                if response.status == 200:
-                    return True
-                return False
+                return response.status
                 
         except Exception as e:
-            self.root.after(0, self.update_results,
-                          self.concurrency_text,
-                          f"Request for {city} failed: {str(e)}\n")
+            self.metrics.record("concurrency", city, time.perf_counter() - start_time, 0, start=start_time)
+            if verbose:
+                self.post_text(self.concurrency_text, f"Request for {city} failed: {str(e)}\n")
             raise e
 
     def update_results(self, text_widget, content):
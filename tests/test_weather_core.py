@@ -0,0 +1,296 @@
+import asyncio
+import json
+import random
+import unittest
+
+from weather_core import (
+    LatencyHistogram, ResultStore, RefreshSchedule, ChangeTracker, TokenBucket, BatchScheduler,
+    AdaptiveScheduler, WeatherObservation
+)
+
+def observation(dt, temp=10.0):
+    return WeatherObservation(1, "Oslo", dt, temp, 50, "light rain", 3.0)
+
+def payload(dt):
+    return json.dumps({"id": 1, "name": "Oslo", "dt": dt, "main": {"temp": 10.0, "humidity": 50},
+                       "weather": [{"description": "light rain"}], "wind": {"speed": 3.0}}).encode()
+
+class LatencyHistogramTest(unittest.TestCase):
+    def test_percentiles_within_precision(self):
+        histogram = LatencyHistogram()
+        for i in range(1, 1001):
+            histogram.record(i / 1000)
+        self.assertEqual(histogram.total, 1000)
+        for p, expected in ((50, 0.5), (99, 0.99)):
+            self.assertAlmostEqual(histogram.percentile(p), expected, delta=expected * histogram.precision)
+        self.assertEqual(histogram.percentile(100), 1.0)
+
+    def test_merge_matches_combined_recording(self):
+        rng = random.Random(1)
+        samples = [rng.lognormvariate(-3, 1) for _ in range(2000)]
+        combined, first, second = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+        for i, value in enumerate(samples):
+            combined.record(value)
+            (first if i % 2 else second).record(value)
+        merged = first.copy().merge(second)
+        self.assertEqual(merged.total, combined.total)
+        self.assertEqual(merged.percentiles(), combined.percentiles())
+        self.assertEqual(first.total, 1000)  # copy() left the original alone
+
+    def test_merge_rejects_other_layouts(self):
+        with self.assertRaises(ValueError):
+            LatencyHistogram().merge(LatencyHistogram(precision=0.1))
+
+    def test_dict_round_trip(self):
+        histogram = LatencyHistogram()
+        for value in (0.01, 0.02, 0.5, 3.0):
+            histogram.record(value)
+        restored = LatencyHistogram.from_dict(json.loads(json.dumps(histogram.to_dict())))
+        self.assertEqual(restored.percentiles(), histogram.percentiles())
+        self.assertEqual((restored.min, restored.max), (histogram.min, histogram.max))
+
+    def test_empty(self):
+        self.assertEqual(LatencyHistogram().percentile(99), 0.0)
+        self.assertIsNone(LatencyHistogram().to_dict()["min"])
+
+class ResultStoreTest(unittest.TestCase):
+    def row(self, city, temp, elapsed="0.100", method="Async"):
+        return (city, temp, "Clear" if temp != "N/A" else "Error", elapsed, method)
+
+    def test_ring_keeps_newest_rows(self):
+        store = ResultStore(capacity=3)
+        store.extend(self.row(f"C{i}", i) for i in range(5))
+        self.assertEqual(len(store), 3)
+        self.assertEqual([store.row(slot)[0] for slot in store.select()], ["C2", "C3", "C4"])
+        self.assertEqual(store.row(store.slot_at(0))[0], "C2")
+
+    def test_numeric_sort_puts_missing_values_last(self):
+        store = ResultStore()
+        store.extend([self.row("A", 5), self.row("B", "N/A"), self.row("C", -2), self.row("D", 12)])
+        self.assertEqual([store.row(s)[0] for s in store.select(sort="Temp")], ["C", "A", "D", "B"])
+        self.assertEqual([store.row(s)[0] for s in store.select(sort="Temp", descending=True)], ["D", "A", "C", "B"])
+        self.assertEqual([store.row(s)[0] for s in store.select(sort="City", descending=True)], ["D", "C", "B", "A"])
+
+    def test_failures_only(self):
+        store = ResultStore()
+        store.extend([self.row("A", 5), self.row("B", "N/A"), self.row("C", 1)])
+        self.assertEqual([store.row(s)[0] for s in store.select(failures_only=True)], ["B"])
+
+    def test_upsert_replaces_keyed_rows(self):
+        store = ResultStore(capacity=4)
+        store.upsert([self.row("A", 1), self.row("B", 2)])
+        generation = store.generation
+        store.upsert([self.row("A", 3)])
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.row(store.select()[0]), self.row("A", 3))
+        self.assertGreater(store.generation, generation)
+
+    def test_overwritten_keyed_row_is_forgotten(self):
+        store = ResultStore(capacity=2)
+        store.upsert([self.row("A", 1)])
+        store.extend([self.row("B", 2), self.row("C", 3)])  # C overwrites A's slot
+        store.upsert([self.row("A", 4)])
+        self.assertEqual([store.row(s)[0] for s in store.select()], ["C", "A"])
+
+    def test_clear(self):
+        store = ResultStore()
+        store.extend([self.row("A", 1)])
+        store.clear()
+        self.assertEqual(len(store), 0)
+        self.assertEqual(len(store.select()), 0)
+
+class RefreshScheduleTest(unittest.TestCase):
+    def test_pops_most_overdue_first_and_counts_missed_deadlines(self):
+        schedule = RefreshSchedule(interval=60, jitter=0.0, grace=5.0)
+        schedule.add("A", due=100.0)
+        schedule.add("B", due=90.0)
+        schedule.add("C", due=104.0)
+        self.assertEqual(schedule.next_due(), 90.0)
+        self.assertEqual([schedule.pop(now=103.0) for _ in range(3)], ["B", "A", "C"])
+        self.assertEqual(schedule.missed, 1)  # B was 13s late
+        self.assertEqual(schedule.max_lateness, 13.0)
+        self.assertIsNone(schedule.next_due())
+
+    def test_completed_reschedules_one_interval_out_or_at_the_expected_update(self):
+        schedule = RefreshSchedule(interval=60, jitter=0.0)
+        schedule.add("A", due=0.0)
+        schedule.add("B", interval=300, due=0.0)
+        schedule.pop(now=0.0)
+        schedule.pop(now=0.0)
+        schedule.completed("A", True, now=10.0)
+        schedule.completed("B", True, now=10.0, expected=40.0)
+        self.assertEqual(schedule.pop(now=40.0), "B")
+        self.assertEqual(schedule.next_due(), 70.0)
+        self.assertEqual(schedule.refreshes, 2)
+
+    def test_jitter_stays_within_its_fraction(self):
+        schedule = RefreshSchedule(interval=100, jitter=0.1)
+        for i in range(50):
+            schedule.add(i, due=0.0)
+            schedule.pop(now=0.0)
+            schedule.completed(i, True, now=0.0)
+        dues = []
+        while schedule.next_due() is not None:
+            dues.append(schedule.next_due())
+            schedule.pop(now=0.0)
+        self.assertEqual(len(dues), 50)
+        self.assertTrue(all(90.0 <= due <= 110.0 for due in dues))
+
+    def test_freshness(self):
+        schedule = RefreshSchedule()
+        self.assertIsNone(schedule.freshness())
+        schedule.add("A", due=0.0)
+        schedule.pop(now=0.0)
+        schedule.completed("A", True, now=100.0)
+        self.assertEqual(schedule.freshness(now=130.0), (30.0, 30.0, 30.0))
+
+class ChangeTrackerTest(unittest.TestCase):
+    key = ("oslo", "metric")
+
+    def test_first_response_is_a_change_and_sets_validators(self):
+        tracker = ChangeTracker()
+        self.assertEqual(tracker.headers(self.key), {})
+        status, data, changed = tracker.resolve(self.key, 200, observation(1000), {"ETag": '"a"'})
+        self.assertEqual((status, changed), (200, True))
+        self.assertEqual(tracker.headers(self.key), {"If-None-Match": '"a"'})
+        self.assertEqual(tracker.etag(self.key), '"a"')
+
+    def test_not_modified_returns_the_last_observation(self):
+        tracker = ChangeTracker()
+        first = observation(1000)
+        tracker.resolve(self.key, 200, first, {"ETag": '"a"'})
+        self.assertEqual(tracker.resolve(self.key, 304, None, {}), (200, first, False))
+        self.assertEqual(tracker.not_modified, 1)
+
+    def test_same_or_older_dt_is_unchanged(self):
+        tracker = ChangeTracker()
+        first = observation(1000)
+        tracker.resolve(self.key, 200, first, {})
+        self.assertEqual(tracker.resolve(self.key, 200, observation(1000, 11.0), {}), (200, first, False))
+        self.assertEqual(tracker.resolve(self.key, 200, observation(900), {}), (200, first, False))
+        self.assertEqual(tracker.unchanged, 2)
+
+    def test_decoder_short_circuits_on_matching_dt(self):
+        tracker = ChangeTracker()
+        first = observation(1000)
+        tracker.resolve(self.key, 200, first, {})
+        decode = tracker.decoder(self.key)
+        self.assertIs(decode(payload(1000)), first)
+        self.assertEqual(decode(payload(1600)).dt, 1600)
+
+    def test_next_refresh_follows_the_observed_cadence(self):
+        tracker = ChangeTracker(cadence=600, retry=60)
+        self.assertEqual(tracker.next_refresh(self.key, now=5.0), 5.0)
+        tracker.resolve(self.key, 200, observation(1000), {})
+        self.assertEqual(tracker.next_refresh(self.key, now=1100.0), 1600)
+        tracker.resolve(self.key, 200, observation(1200), {})  # 200s gap smooths the cadence to 400s
+        self.assertEqual(tracker.next_refresh(self.key, now=1300.0), 1600)
+        self.assertEqual(tracker.next_refresh(self.key, now=1700.0), 1760.0)  # overdue: retry
+
+    def test_remember_does_not_override_newer_validators(self):
+        tracker = ChangeTracker()
+        tracker.remember(self.key, observation(1000), '"old"')
+        self.assertEqual(tracker.etag(self.key), '"old"')
+        tracker.resolve(self.key, 200, observation(2000), {"ETag": '"new"'})
+        tracker.remember(self.key, observation(1000), '"old"')
+        self.assertEqual(tracker.etag(self.key), '"new"')
+
+    def test_bounded(self):
+        tracker = ChangeTracker(max_entries=2)
+        for i in range(3):
+            tracker.resolve((f"city{i}", "metric"), 200, observation(1000), {"ETag": str(i)})
+        self.assertIsNone(tracker.etag(("city0", "metric")))
+        self.assertEqual(tracker.etag(("city2", "metric")), "2")
+
+class SchedulerTest(unittest.TestCase):
+    def run_batch(self, scheduler, n, work):
+        peak = 0
+
+        async def request(i):
+            nonlocal peak
+            peak = max(peak, scheduler.in_flight)
+            return await work(i)
+
+        async def batch():
+            return await asyncio.gather(*(scheduler.run(lambda i=i: request(i)) for i in range(n)))
+
+        return asyncio.run(batch()), peak
+
+    def test_batch_scheduler_bounds_in_flight(self):
+        async def work(i):
+            await asyncio.sleep(0.01)
+            return 200
+
+        results, peak = self.run_batch(BatchScheduler(max_in_flight=3), 12, work)
+        self.assertEqual(results, [200] * 12)
+        self.assertEqual(peak, 3)
+
+    def test_batch_scheduler_releases_its_slot_on_errors(self):
+        scheduler = BatchScheduler(max_in_flight=1)
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        async def ok():
+            return 200
+
+        async def batch():
+            with self.assertRaises(RuntimeError):
+                await scheduler.run(fail)
+            return await asyncio.wait_for(scheduler.run(ok), 1)
+
+        self.assertEqual(asyncio.run(batch()), 200)
+        self.assertEqual(scheduler.in_flight, 0)
+
+    def test_shared_token_bucket_paces_every_scheduler(self):
+        async def batch():
+            bucket = TokenBucket(rate=100, burst=1)
+            schedulers = [BatchScheduler(max_in_flight=10, bucket=bucket), AdaptiveScheduler(bucket=bucket)]
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+
+            async def ok():
+                return 200
+
+            await asyncio.gather(*(scheduler.run(ok) for scheduler in schedulers for _ in range(10)))
+            return loop.time() - start
+
+        # 20 requests at 100/s from a one-token burst take about 0.19s
+        self.assertGreaterEqual(asyncio.run(batch()), 0.17)
+
+    def test_adaptive_limit_grows_while_healthy(self):
+        scheduler = AdaptiveScheduler(initial_limit=2, max_limit=10)
+        for _ in range(300):
+            scheduler._observe(started_at=float("inf"), latency=0.1, congested=False)
+        self.assertEqual(scheduler.cuts, 0)
+        self.assertEqual((scheduler.max_in_flight, scheduler.peak_limit), (10, 10))
+
+    def test_adaptive_limit_is_cut_on_congestion(self):
+        async def work(i):
+            await asyncio.sleep(0.001)
+            return 429 if i >= 100 else 200
+
+        scheduler = AdaptiveScheduler(initial_limit=8, min_limit=2)
+        self.run_batch(scheduler, 200, work)
+        self.assertGreater(scheduler.cuts, 0)
+        self.assertEqual(scheduler.max_in_flight, 2)
+
+    def test_single_slow_requests_do_not_cut_the_limit(self):
+        scheduler = AdaptiveScheduler(initial_limit=4)
+        for i in range(200):
+            # One request in ten is five times slower than the rest
+            scheduler._observe(started_at=float("inf"), latency=0.5 if i % 10 == 0 else 0.1, congested=False)
+        self.assertEqual(scheduler.cuts, 0)
+
+    def test_sustained_latency_spike_cuts_the_limit(self):
+        scheduler = AdaptiveScheduler(initial_limit=16, recent_window=10, baseline_window=100)
+        for _ in range(100):
+            scheduler._observe(started_at=float("inf"), latency=0.1, congested=False)
+        limit = scheduler.limit
+        for _ in range(10):
+            scheduler._observe(started_at=float("inf"), latency=0.5, congested=False)
+        self.assertEqual(scheduler.cuts, 1)
+        self.assertLess(scheduler.limit, limit)
+
+if __name__ == "__main__":
+    unittest.main()
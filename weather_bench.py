@@ -0,0 +1,389 @@
+# Headless benchmark for the sync, threaded, process and async batch strategies.
+#
+#   python -m weather_bench --requests 200 --latency lognormal:-2.5,0.5 --error-rate 0.02
+#
+# Runs against a bundled aiohttp mock of /data/2.5/weather unless --url is given,
+# and prints a JSON report (throughput, latency percentiles, error counts). Requests go
+# through the app's own pipeline from weather_core: decode_observation, the batch or
+# adaptive scheduler with a shared token bucket and, with --cache, the TTL cache and
+# single-flight.
+#
+#   python -m weather_bench --merge run1.json run2.json
+#
+# Merges the latency histograms of earlier reports into combined percentiles.
+import argparse
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import aiohttp
+import numpy as np
+from aiohttp import web
+
+from weather_core import (
+    create_sync_session, create_async_session, process_fetch_city, timed_sync_get, read_timed,
+    decode_observation, LatencyHistogram, WeatherCache, SingleFlight, TokenBucket, BatchScheduler,
+    AdaptiveScheduler, UPSTREAM_SOURCES
+)
+
+STRATEGIES = ("sync", "threaded", "process", "async")
+
+def parse_latency(spec, rng):
+    # "fixed:0.05", "uniform:0.02,0.2", "exponential:0.05" or "lognormal:mu,sigma" (seconds)
+    kind, _, args = spec.partition(":")
+    params = [float(arg) for arg in args.split(",") if arg]
+    if kind == "fixed":
+        return lambda: params[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(params[0], params[1])
+    if kind == "exponential":
+        return lambda: rng.expovariate(1 / params[0])
+    if kind == "lognormal":
+        return lambda: rng.lognormvariate(params[0], params[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+def mock_weather_payload(city):
+    seed = sum(ord(c) for c in city)
+    return {
+        "id": 100000 + seed,
+        "name": city,
+        "dt": int(time.time()) // 600 * 600,
+        "main": {"temp": round(-10 + seed % 400 / 10, 1), "humidity": seed % 100},
+        "weather": [{"description": "scattered clouds"}],
+        "wind": {"speed": round(seed % 150 / 10, 1)}
+    }
+
+class MockWeatherServer:
+    # Local stand-in for the OpenWeatherMap /weather endpoint, run on its own loop thread
+    def __init__(self, host="127.0.0.1", port=0, latency="fixed:0.05",
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after=1, seed=None):
+        self.host = host
+        self.port = port
+        self.rng = random.Random(seed)
+        self.latency = parse_latency(latency, self.rng)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.requests_served = 0
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._started = threading.Event()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/data/2.5/weather"
+
+    async def handle_weather(self, request):
+        self.requests_served += 1
+        await asyncio.sleep(self.latency())
+
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            return web.json_response({"cod": 429, "message": "Rate limit exceeded"}, status=429,
+                                     headers={"Retry-After": str(self.retry_after)})
+        if roll < self.rate_limit_rate + self.error_rate:
+            return web.json_response({"cod": 500, "message": "Internal error"}, status=500)
+
+        city = request.query.get("q", "Unknown")
+        return web.json_response(mock_weather_payload(city))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+        app = web.Application()
+        app.router.add_get("/data/2.5/weather", self.handle_weather)
+        self._runner = web.AppRunner(app)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        # Pick up the real port when an ephemeral one was requested
+        self.port = self._runner.addresses[0][1]
+        self._started.set()
+        self._loop.run_forever()
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+
+# Each runner returns (latency, outcome, source) per request: outcome is the HTTP status or
+# the exception name, source is "network", "cache" or "coalesced" as in the app
+
+def cache_key(city):
+    return (city.strip().lower(), "metric")
+
+def create_cache(options):
+    return WeatherCache(ttl=options.cache_ttl, max_entries=options.requests) if options.cache else None
+
+def fetch_sync(session, url, city, options, cache=None):
+    start = time.perf_counter()
+    if cache is not None and cache.get(cache_key(city)) is not None:
+        return time.perf_counter() - start, 200, "cache"
+    try:
+        response, data = timed_sync_get(session, url, {"q": city, "appid": options.api_key, "units": "metric"},
+                                        timeout=options.timeout, decode=decode_observation)
+        if cache is not None and response.status_code == 200:
+            cache.put(cache_key(city), data)
+        return time.perf_counter() - start, response.status_code, "network"
+    except Exception as e:
+        return time.perf_counter() - start, type(e).__name__, "network"
+
+def run_sync(url, cities, options, stats):
+    cache = create_cache(options)
+    with create_sync_session(max_retries=options.retries) as session:
+        return [fetch_sync(session, url, city, options, cache) for city in cities]
+
+def run_threaded(url, cities, options, stats):
+    cache = create_cache(options)
+    with create_sync_session(pool_size=options.workers, max_retries=options.retries) as session:
+        with ThreadPoolExecutor(max_workers=options.workers) as executor:
+            return list(executor.map(lambda city: fetch_sync(session, url, city, options, cache), cities))
+
+def run_process(url, cities, options, stats):
+    # Like the app, cache hits are answered in this process and the misses are submitted up front
+    cache = create_cache(options)
+    results = []
+    futures = []
+    with ProcessPoolExecutor(max_workers=options.processes) as executor:
+        for city in cities:
+            start = time.perf_counter()
+            if cache is not None and cache.get(cache_key(city)) is not None:
+                results.append((time.perf_counter() - start, 200, "cache"))
+                continue
+            futures.append((city, executor.submit(process_fetch_city, url, options.api_key, "metric", city,
+                                                  options.timeout, options.retries)))
+        
+        for city, future in futures:
+            status, data, elapsed, _ = future.result()
+            if cache is not None and status == 200:
+                cache.put(cache_key(city), data)
+            results.append((elapsed, status, "network"))
+    return results
+
+async def fetch_async(session, scheduler, url, city, options, cache=None, single_flight=None):
+    start = time.perf_counter()
+    key = cache_key(city)
+    if cache is not None and cache.get(key) is not None:
+        return time.perf_counter() - start, 200, "cache"
+    
+    # Timed from when the scheduler lets the request go, as the pools time theirs from when a
+    # worker picks it up; queueing shows up in the scheduler's wait figures instead
+    sent = start
+    
+    async def get():
+        nonlocal sent
+        sent = time.perf_counter()
+        async with session.get(url, params={"q": city, "appid": options.api_key, "units": "metric"},
+                               timeout=aiohttp.ClientTimeout(total=options.timeout)) as response:
+            data = await read_timed(response, None, decode_observation)
+            if cache is not None and response.status == 200:
+                cache.put(key, data)
+            return response.status, data
+    
+    try:
+        if single_flight is None:
+            (status, _), leader = await scheduler.run(get), True
+        else:
+            (status, _), leader = await single_flight.do(key, lambda: scheduler.run(get))
+        return time.perf_counter() - sent, status, "network" if leader else "coalesced"
+    except Exception as e:
+        return time.perf_counter() - sent, type(e).__name__, "network"
+
+def create_scheduler(options):
+    # One token bucket (when --rate-limit is set) behind either in-flight limiter, as in the app
+    bucket = TokenBucket(options.rate_limit / 60, options.rate_limit) if options.rate_limit > 0 else None
+    if options.adaptive:
+        return AdaptiveScheduler(max_limit=options.concurrency, bucket=bucket)
+    return BatchScheduler(max_in_flight=options.concurrency, bucket=bucket)
+
+async def run_async_batch(url, cities, options, stats):
+    scheduler = create_scheduler(options)
+    cache = create_cache(options)
+    single_flight = SingleFlight() if options.cache else None
+    async with create_async_session(limit=options.concurrency, limit_per_host=options.concurrency) as session:
+        results = await asyncio.gather(*[
+            fetch_async(session, scheduler, url, city, options, cache, single_flight) for city in cities])
+    
+    stats["scheduler"] = {
+        "type": type(scheduler).__name__,
+        "max_in_flight": scheduler.max_in_flight,
+        "average_wait_s": round(scheduler.average_wait, 5),
+        "max_wait_s": round(scheduler.max_wait, 5)
+    }
+    if options.adaptive:
+        stats["scheduler"].update(peak_limit=scheduler.peak_limit, cuts=scheduler.cuts)
+    return results
+
+def run_async(url, cities, options, stats):
+    return asyncio.run(run_async_batch(url, cities, options, stats))
+
+RUNNERS = {"sync": run_sync, "threaded": run_threaded, "process": run_process, "async": run_async}
+
+def latency_stats(latencies):
+    latencies = np.array(latencies)
+    if not len(latencies):
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "mean": round(float(latencies.mean()), 5),
+        "p50": round(float(p50), 5),
+        "p95": round(float(p95), 5),
+        "p99": round(float(p99), 5),
+        "max": round(float(latencies.max()), 5)
+    }
+
+def summarize(results, elapsed, stats=None):
+    # Latency covers requests that went upstream: "latency_s" and the histogram the successful
+    # ones, "latency_all_s" the failures too. Cache hits and coalesced calls are only counted
+    histogram = LatencyHistogram()
+    successes = []
+    upstream = []
+    served = {}
+    errors = {}
+    for latency, outcome, source in results:
+        if source not in UPSTREAM_SOURCES:
+            served[source] = served.get(source, 0) + 1
+            continue
+        upstream.append(latency)
+        if outcome != 200:
+            key = f"http_{outcome}" if isinstance(outcome, int) else outcome
+            errors[key] = errors.get(key, 0) + 1
+        else:
+            successes.append(latency)
+            histogram.record(latency)
+
+    return {
+        "requests": len(results),
+        "ok": len(successes),
+        "errors": errors,
+        "served_locally": served,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_s": latency_stats(successes),
+        "latency_all_s": latency_stats(upstream),
+        "histogram": histogram.to_dict(),
+        **(stats or {})
+    }
+
+def merge_reports(paths):
+    # Combine the successful-request histograms of earlier reports, per strategy
+    merged = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            report = json.load(f)
+        for strategy, summary in report["strategies"].items():
+            histogram = LatencyHistogram.from_dict(summary["histogram"])
+            if strategy in merged:
+                merged[strategy].merge(histogram)
+            else:
+                merged[strategy] = histogram
+    
+    return {
+        "merged": list(paths),
+        "strategies": {
+            strategy: {
+                "ok": histogram.total,
+                "latency_s": {f"p{p:g}": round(value, 5) for p, value in histogram.percentiles().items()},
+                "histogram": histogram.to_dict()
+            }
+            for strategy, histogram in merged.items()
+        }
+    }
+
+def run_benchmark(options):
+    server = None
+    url = options.url
+    if url is None:
+        server = MockWeatherServer(
+            latency=options.latency,
+            error_rate=options.error_rate,
+            rate_limit_rate=options.rate_limit_rate,
+            seed=options.seed
+        ).start()
+        url = server.url
+
+    # --distinct repeats a smaller set of cities so the cache and single-flight have work to do
+    distinct = options.distinct or options.requests
+    cities = [f"City{i % distinct + 1}" for i in range(options.requests)]
+    report = {"config": {key: value for key, value in vars(options).items() if key != "api_key"},
+              "strategies": {}}
+    try:
+        for strategy in options.strategies:
+            stats = {}
+            start = time.perf_counter()
+            results = RUNNERS[strategy](url, cities, options, stats)
+            report["strategies"][strategy] = summarize(results, time.perf_counter() - start, stats)
+    finally:
+        if server is not None:
+            server.stop()
+    return report
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="weather_bench", description=(
+        "Benchmark sync, threaded, process and async weather fetching against a local mock server."))
+    parser.add_argument("--requests", type=int, default=100, help="requests per strategy")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES),
+                        type=lambda value: [s.strip() for s in value.split(",") if s.strip()],
+                        help="comma separated subset of: " + ", ".join(STRATEGIES))
+    parser.add_argument("--latency", default="fixed:0.05", help=(
+        "mock latency distribution: fixed:S, uniform:LO,HI, exponential:MEAN or lognormal:MU,SIGMA"))
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock 500 responses")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of mock 429 responses")
+    parser.add_argument("--workers", type=int, default=10, help="thread pool size for the threaded strategy")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 2,
+                        help="process pool size for the process strategy")
+    parser.add_argument("--concurrency", type=int, default=50, help=(
+        "max in-flight requests for the async strategy (the ceiling with --adaptive)"))
+    parser.add_argument("--adaptive", action="store_true",
+                        help="let the async strategy's AIMD scheduler find its own in-flight limit")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="requests per minute for the async strategy's token bucket (0 = none)")
+    parser.add_argument("--cache", action="store_true",
+                        help="answer repeats from the TTL cache (and coalesce concurrent async ones)")
+    parser.add_argument("--cache-ttl", type=float, default=600.0, help="cache TTL in seconds")
+    parser.add_argument("--distinct", type=int, default=0,
+                        help="number of distinct cities the requests cycle through (0 = all distinct)")
+    parser.add_argument("--retries", type=int, default=0, help="retries for the pooled requests session")
+    parser.add_argument("--timeout", type=float, default=10.0, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the mock's latency and error draws")
+    parser.add_argument("--url", default=None, help="benchmark this /weather URL instead of the bundled mock")
+    parser.add_argument("--api-key", default="bench", help="appid sent with each request")
+    parser.add_argument("--output", default=None, help="write the JSON report here instead of stdout")
+    parser.add_argument("--merge", nargs="+", default=None, metavar="REPORT",
+                        help="merge the latency histograms of earlier JSON reports instead of running")
+    options = parser.parse_args(argv)
+
+    unknown = [s for s in options.strategies if s not in RUNNERS]
+    if unknown:
+        parser.error(f"unknown strategies: {', '.join(unknown)}")
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    report = merge_reports(options.merge) if options.merge else run_benchmark(options)
+    report = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1650 @@
+# UI-free building blocks shared by the Tkinter app and the headless benchmark: payload
+# decoders, timed HTTP sessions, traffic record/replay, the process pool worker, the
+# latency histogram, the caches, single-flight, change tracking, the request schedulers,
+# the metrics store and the result stores. Nothing here imports tkinter or matplotlib, so
+# weather_bench (and process pool workers) can load it on a headless machine.
+import asyncio
+import contextlib
+import csv
+import gzip
+import heapq
+import itertools
+import json
+import math
+import os
+import queue
+import random
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict, deque
+from io import BytesIO
+
+import aiohttp
+import numpy as np
+import requests
+from multidict import CIMultiDict
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+import urllib3
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Optional fast JSON decoders; the stdlib json module is the fallback
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class WeatherObservation:
+    # The /weather fields the app actually uses, shared by the UI, the cache and workers
+    __slots__ = ("city_id", "name", "dt", "temp", "humidity", "description", "wind_speed")
+
+    def __init__(self, city_id, name, dt, temp, humidity, description, wind_speed):
+        self.city_id = city_id
+        self.name = name
+        self.dt = dt
+        self.temp = temp
+        self.humidity = humidity
+        self.description = description
+        self.wind_speed = wind_speed
+
+    @classmethod
+    def from_dict(cls, data):
+        weather = data.get("weather") or []
+        return cls(data["id"], data["name"], data.get("dt", 0), data["main"]["temp"], data["main"].get("humidity", 0),
+                   weather[0].get("description", "") if weather else "", data["wind"].get("speed", 0.0))
+
+    def __repr__(self):
+        return f"WeatherObservation({self.name!r}, temp={self.temp}, description={self.description!r})"
+
+# Per-step variables kept from /forecast payloads, in array column order
+FORECAST_VARIABLES = ("temp", "humidity", "wind_speed")
+
+if msgspec is not None:
+    # Typed schemas let msgspec skip building dicts for the fields we ignore
+    class _Main(msgspec.Struct):
+        temp: int | float
+        humidity: int | float = 0
+
+    class _Condition(msgspec.Struct):
+        description: str = ""
+
+    class _Wind(msgspec.Struct):
+        speed: int | float = 0
+
+    class _Payload(msgspec.Struct):
+        id: int
+        name: str
+        main: _Main
+        wind: _Wind
+        dt: int = 0
+        weather: list[_Condition] = []
+
+    class _GroupPayload(msgspec.Struct):
+        cities: list[_Payload] = msgspec.field(default_factory=list, name="list")
+
+    class _ForecastStep(msgspec.Struct):
+        dt: int
+        main: _Main
+        wind: _Wind = msgspec.field(default_factory=_Wind)
+
+    class _ForecastPayload(msgspec.Struct):
+        steps: list[_ForecastStep] = msgspec.field(default_factory=list, name="list")
+
+    _payload_decoder = msgspec.json.Decoder(_Payload)
+    _group_decoder = msgspec.json.Decoder(_GroupPayload)
+    _forecast_decoder = msgspec.json.Decoder(_ForecastPayload)
+
+    def _observation(payload):
+        return WeatherObservation(payload.id, payload.name, payload.dt, payload.main.temp, payload.main.humidity,
+                                  payload.weather[0].description if payload.weather else "", payload.wind.speed)
+
+    def decode_observation(body):
+        return _observation(_payload_decoder.decode(body))
+
+    def decode_group(body):
+        return [_observation(payload) for payload in _group_decoder.decode(body).cities]
+
+    def decode_forecast(body):
+        # (timestamps, steps x FORECAST_VARIABLES array)
+        steps = _forecast_decoder.decode(body).steps
+        times = np.fromiter((step.dt for step in steps), dtype=np.int64, count=len(steps))
+        values = np.array([(step.main.temp, step.main.humidity, step.wind.speed) for step in steps],
+                          dtype=np.float32).reshape(len(steps), len(FORECAST_VARIABLES))
+        return times, values
+
+    decode_json = msgspec.json.decode
+    JSON_BACKEND = "msgspec"
+else:
+    decode_json = orjson.loads if orjson is not None else json.loads
+    JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+    def decode_observation(body):
+        return WeatherObservation.from_dict(decode_json(body))
+
+    def decode_group(body):
+        return [WeatherObservation.from_dict(item) for item in decode_json(body).get("list", [])]
+
+    def decode_forecast(body):
+        steps = decode_json(body).get("list", [])
+        times = np.array([step["dt"] for step in steps], dtype=np.int64)
+        values = np.array([(step["main"]["temp"], step["main"].get("humidity", 0), step.get("wind", {}).get("speed", 0))
+                           for step in steps], dtype=np.float32).reshape(len(steps), len(FORECAST_VARIABLES))
+        return times, values
+
+# Request phases in the order they happen; durations are perf_counter seconds.
+# "queue" covers scheduler and connection pool waits.
+PHASES = ("queue", "dns", "connect", "tls", "ttfb", "body", "decode")
+
+_sync_phases = threading.local()
+
+def _add_sync_phase(phase, seconds):
+    phases = getattr(_sync_phases, "current", None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+class _TimedConnectMixin:
+    # Splits new urllib3 connections into TCP connect (including DNS) and TLS handshake
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            return super()._new_conn()
+        finally:
+            self._tcp_seconds = time.perf_counter() - start
+
+    def connect(self):
+        start = time.perf_counter()
+        self._tcp_seconds = 0.0
+        try:
+            super().connect()
+        finally:
+            _add_sync_phase("connect", self._tcp_seconds)
+            _add_sync_phase("tls", time.perf_counter() - start - self._tcp_seconds)
+
+class TimedHTTPConnection(_TimedConnectMixin, HTTPConnection):
+    pass
+
+class TimedHTTPSConnection(_TimedConnectMixin, HTTPSConnection):
+    pass
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool
+        }
+
+def timed_sync_get(session, url, params, timeout=10, phases=None, decode=decode_json, headers=None):
+    # GET and decode the body (with `decode` on 200, as plain JSON otherwise, None for a 304),
+    # filling `phases` (if given) with per-phase durations
+    phases = {} if phases is None else phases
+    _sync_phases.current = phases
+    start = time.perf_counter()
+    try:
+        response = session.get(url, params=params, timeout=timeout, stream=True, headers=headers)
+    finally:
+        _sync_phases.current = None
+    
+    headers_at = time.perf_counter()
+    phases["ttfb"] = headers_at - start - sum(phases.get(phase, 0.0) for phase in ("connect", "tls"))
+    body = response.content
+    body_at = time.perf_counter()
+    phases["body"] = body_at - headers_at
+    data = None if response.status_code == 304 else (decode if response.status_code == 200 else decode_json)(body)
+    phases["decode"] = time.perf_counter() - body_at
+    return response, data
+
+def create_phase_trace_config():
+    # aiohttp hooks that fill the dict passed as `trace_request_ctx` with per-phase durations
+    def add(ctx, phase, seconds):
+        ctx.setup += seconds
+        if ctx.trace_request_ctx is not None:
+            ctx.trace_request_ctx[phase] = ctx.trace_request_ctx.get(phase, 0.0) + seconds
+    
+    async def on_request_start(session, ctx, params):
+        ctx.start = time.perf_counter()
+        ctx.setup = 0.0
+        ctx.dns = 0.0
+    
+    async def on_connection_queued_start(session, ctx, params):
+        ctx.queued_at = time.perf_counter()
+    
+    async def on_connection_queued_end(session, ctx, params):
+        add(ctx, "queue", time.perf_counter() - ctx.queued_at)
+    
+    async def on_connection_create_start(session, ctx, params):
+        ctx.create_at = time.perf_counter()
+        ctx.dns_before = ctx.dns
+    
+    async def on_connection_create_end(session, ctx, params):
+        # DNS resolution happens inside connection creation; count it only once
+        add(ctx, "connect", time.perf_counter() - ctx.create_at - (ctx.dns - ctx.dns_before))
+    
+    async def on_dns_resolvehost_start(session, ctx, params):
+        ctx.dns_at = time.perf_counter()
+    
+    async def on_dns_resolvehost_end(session, ctx, params):
+        seconds = time.perf_counter() - ctx.dns_at
+        ctx.dns += seconds
+        add(ctx, "dns", seconds)
+    
+    async def on_request_end(session, ctx, params):
+        add(ctx, "ttfb", time.perf_counter() - ctx.start - ctx.setup)
+    
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_queued_start.append(on_connection_queued_start)
+    trace_config.on_connection_queued_end.append(on_connection_queued_end)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+async def read_timed(response, phases=None, decode=decode_json):
+    # Reads the body and decodes it as two separately timed phases
+    body_at = time.perf_counter()
+    body = await response.read()
+    decode_at = time.perf_counter()
+    data = None if response.status == 304 else (decode if response.status == 200 else decode_json)(body)
+    if phases is not None:
+        phases["body"] = decode_at - body_at
+        phases["decode"] = time.perf_counter() - decode_at
+    return data
+
+def format_phases(phases):
+    return " | ".join(f"{phase} {phases[phase] * 1000:.1f}ms" for phase in PHASES if phases.get(phase))
+
+def create_sync_session(pool_size=20, max_retries=3, backoff_factor=0.5, recorder=None):
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter_kwargs = {"pool_connections": pool_size, "pool_maxsize": pool_size, "max_retries": retry}
+    if recorder is not None:
+        adapter = RecordingHTTPAdapter(recorder, **adapter_kwargs)
+    else:
+        adapter = TimedHTTPAdapter(**adapter_kwargs)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def create_async_session(limit=100, limit_per_host=20, dns_ttl=300, keepalive_timeout=30):
+    # Must be called from inside the event loop that will own the session
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=dns_ttl,
+        keepalive_timeout=keepalive_timeout
+    )
+    return aiohttp.ClientSession(connector=connector, trace_configs=[create_phase_trace_config()])
+
+def create_replay_session(replay):
+    session = requests.Session()
+    adapter = ReplayHTTPAdapter(replay)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def traffic_key(url, params=None):
+    # Recorded exchanges are matched on path and query, without the API key
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qsl(parts.query) + [(key, str(value)) for key, value in (params or {}).items()]
+    return parts.path + "?" + urllib.parse.urlencode(sorted(pair for pair in query if pair[0] != "appid"))
+
+def error_kind(error):
+    # "timeout", "connection" or "error" for a failed exchange on either transport
+    if isinstance(error, (requests.exceptions.Timeout, asyncio.TimeoutError)):
+        return "timeout"
+    # With retries mounted, requests reports an exhausted read timeout as a ConnectionError
+    reason = getattr(error.args[0] if error.args else None, "reason", None)
+    if (isinstance(reason, urllib3.exceptions.TimeoutError)
+            and not isinstance(reason, urllib3.exceptions.NewConnectionError)):
+        return "timeout"
+    if isinstance(error, (requests.exceptions.ConnectionError, aiohttp.ClientConnectionError)):
+        return "connection"
+    return "error"
+
+# What a recorded failure is raised as on replay, per transport
+SYNC_ERRORS = {"timeout": requests.exceptions.ReadTimeout, "connection": requests.exceptions.ConnectionError,
+               "error": requests.exceptions.RequestException}
+ASYNC_ERRORS = {"timeout": asyncio.TimeoutError, "connection": aiohttp.ClientConnectionError,
+                "error": aiohttp.ClientError}
+
+def timeout_seconds(timeout):
+    # Total seconds allowed by a requests (number or (connect, read)) or aiohttp
+    # (number or ClientTimeout) timeout; None when unbounded
+    if isinstance(timeout, aiohttp.ClientTimeout):
+        return timeout.total
+    if isinstance(timeout, tuple):
+        parts = [part for part in timeout if part is not None]
+        return sum(parts) if parts else None
+    return timeout
+
+class TrafficRecorder:
+    # Appends upstream exchanges (status, a few headers, body and observed latency) to a
+    # gzipped JSON Lines file, and failed exchanges as their error kind and time to failure;
+    # safe to call from any thread
+    HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Retry-After")
+
+    def __init__(self, path):
+        self.path = path
+        self.recorded = 0
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def record(self, key, status, headers, body, latency):
+        line = json.dumps({
+            "key": key,
+            "status": status,
+            "latency": round(latency, 6),
+            "headers": {name: headers[name] for name in self.HEADERS if name in headers},
+            "body": body.decode("utf-8", errors="replace")
+        }, separators=(",", ":"))
+        self._write(line)
+
+    def record_error(self, key, error, latency):
+        self._write(json.dumps({
+            "key": key,
+            "error": error_kind(error),
+            "message": str(error),
+            "latency": round(latency, 6)
+        }, separators=(",", ":")))
+
+    def _write(self, line):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line + "\n")
+            self.recorded += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class TrafficReplay:
+    # Serves recorded exchanges by key, cycling through the recordings of a repeated request
+    # so its latency profile (failures included) is reproduced; latencies are multiplied by `scale`
+    MISSING = (404, {"Content-Type": "application/json"}, b'{"cod": "404", "message": "not in recording"}',
+               0.0, None)
+
+    def __init__(self, path, scale=1.0):
+        self.path = path
+        self.scale = scale
+        self.served = 0
+        self.missing = 0
+        self._entries = {}
+        self._cursors = {}
+        self._lock = threading.Lock()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                self._entries.setdefault(entry["key"], []).append(entry)
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def lookup(self, key):
+        # (status, headers, body, delay, error) for the next recording of `key`; for a
+        # recorded failure only `delay` is set and `error` is (kind, message)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.missing += 1
+                return self.MISSING
+            i = self._cursors.get(key, 0)
+            self._cursors[key] = i + 1
+            self.served += 1
+        entry = entries[i % len(entries)]
+        delay = entry["latency"] * self.scale
+        if "error" in entry:
+            return None, None, None, delay, (entry["error"], entry["message"])
+        return entry["status"], entry["headers"], entry["body"].encode("utf-8"), delay, None
+
+class RecordingHTTPAdapter(TimedHTTPAdapter):
+    # Records every response; the body is read here so the latency covers the whole exchange
+    def __init__(self, recorder, *args, **kwargs):
+        self.recorder = recorder
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+            body = response.content
+        except requests.exceptions.RequestException as e:
+            self.recorder.record_error(traffic_key(request.url), e, time.perf_counter() - start)
+            raise
+        self.recorder.record(traffic_key(request.url), response.status_code, response.headers, body,
+                             time.perf_counter() - start)
+        return response
+
+class ReplayHTTPAdapter(HTTPAdapter):
+    # Answers requests from a TrafficReplay instead of the network
+    def __init__(self, replay):
+        super().__init__()
+        self.replay = replay
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        status, headers, body, delay, error = self.replay.lookup(traffic_key(request.url))
+        limit = timeout_seconds(timeout)
+        if limit is not None and delay > limit:
+            time.sleep(limit)
+            raise requests.exceptions.ReadTimeout(f"Replayed response took {delay:.3f}s", request=request)
+        time.sleep(delay)
+        if error is not None:
+            raise SYNC_ERRORS[error[0]](error[1], request=request)
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response.raw = BytesIO(body)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+class RecordingSession:
+    # Wraps an aiohttp session and records each GET; like RecordingHTTPAdapter it reads the body up front
+    def __init__(self, session, recorder):
+        self.session = session
+        self.recorder = recorder
+
+    @property
+    def closed(self):
+        return self.session.closed
+
+    async def close(self):
+        await self.session.close()
+
+    @contextlib.asynccontextmanager
+    async def get(self, url, params=None, **kwargs):
+        start = time.perf_counter()
+        async with contextlib.AsyncExitStack() as stack:
+            try:
+                response = await stack.enter_async_context(self.session.get(url, params=params, **kwargs))
+                body = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.recorder.record_error(traffic_key(url, params), e, time.perf_counter() - start)
+                raise
+            self.recorder.record(traffic_key(url, params), response.status, response.headers, body,
+                                 time.perf_counter() - start)
+            yield response
+
+class ReplayResponse:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = CIMultiDict(headers)
+        self._body = body
+
+    async def read(self):
+        return self._body
+
+    async def text(self):
+        return self._body.decode("utf-8")
+
+    async def json(self):
+        return decode_json(self._body)
+
+class ReplaySession:
+    # Stand-in for an aiohttp session that answers from a TrafficReplay; the recorded latency
+    # is reported as time to first byte
+    def __init__(self, replay):
+        self.replay = replay
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+    @contextlib.asynccontextmanager
+    async def get(self, url, params=None, trace_request_ctx=None, timeout=None, **kwargs):
+        status, headers, body, delay, error = self.replay.lookup(traffic_key(url, params))
+        limit = timeout_seconds(timeout)
+        if limit is not None and delay > limit:
+            await asyncio.sleep(limit)
+            raise asyncio.TimeoutError()
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise ASYNC_ERRORS[error[0]](error[1])
+        if trace_request_ctx is not None:
+            trace_request_ctx["ttfb"] = trace_request_ctx.get("ttfb", 0.0) + delay
+        yield ReplayResponse(status, headers, body)
+
+_process_session = None
+
+def init_process_worker(replay_path=None, scale=1.0):
+    # ProcessPoolExecutor initializer: in replay mode each worker answers from its own
+    # copy of the recording instead of building a live session
+    global _process_session
+    _process_session = create_replay_session(TrafficReplay(replay_path, scale)) if replay_path else None
+
+def process_fetch_city(url, api_key, units, city, timeout=10, max_retries=3):
+    # Runs inside a ProcessPoolExecutor worker; each worker keeps its own pooled session
+    global _process_session
+    if _process_session is None:
+        _process_session = create_sync_session(pool_size=1, max_retries=max_retries)
+    
+    start_time = time.perf_counter()
+    phases = {}
+    try:
+        response, data = timed_sync_get(
+            _process_session,
+            url,
+            {"q": city, "appid": api_key, "units": units},
+            timeout=timeout,
+            phases=phases,
+            decode=decode_observation
+        )
+        return response.status_code, data, time.perf_counter() - start_time, phases
+    except Exception as e:
+        return type(e).__name__, {"message": str(e)}, time.perf_counter() - start_time, phases
+
+class LatencyHistogram:
+    # HDR-style latency histogram: log-spaced buckets with a fixed relative error
+    # (`precision`), so memory is constant and histograms with the same layout merge
+    # by adding their counts
+    def __init__(self, lowest=1e-4, highest=120.0, precision=0.01):
+        self.lowest = lowest
+        self.highest = highest
+        self.precision = precision
+        self._log_base = math.log1p(precision)
+        self.counts = np.zeros(self._index(highest) + 1, dtype=np.int64)
+        self.total = 0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _index(self, value):
+        if value <= self.lowest:
+            return 0
+        return int(math.log(min(value, self.highest) / self.lowest) / self._log_base)
+
+    def record(self, value):
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def copy(self):
+        return LatencyHistogram(self.lowest, self.highest, self.precision).merge(self)
+
+    def merge(self, other):
+        if (other.lowest, other.highest, other.precision) != (self.lowest, self.highest, self.precision):
+            raise ValueError("Cannot merge histograms with different bucket layouts")
+        self.counts += other.counts
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, p):
+        if not self.total:
+            return 0.0
+        rank = max(1, math.ceil(p / 100 * self.total))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        # Report the bucket's upper bound, clamped to what was actually seen
+        return min(max(self.lowest * (1 + self.precision) ** (index + 1), self.min), self.max)
+
+    def percentiles(self, ps=(50, 90, 99, 99.9)):
+        return {p: self.percentile(p) for p in ps}
+
+    def to_dict(self):
+        nonzero = np.flatnonzero(self.counts)
+        return {
+            "lowest": self.lowest,
+            "highest": self.highest,
+            "precision": self.precision,
+            "total": self.total,
+            "min": self.min if self.total else None,
+            "max": self.max,
+            "counts": {str(i): int(self.counts[i]) for i in nonzero}
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data["lowest"], data["highest"], data["precision"])
+        for index, count in data["counts"].items():
+            histogram.counts[int(index)] = count
+        histogram.total = data["total"]
+        histogram.min = data["min"] if data["min"] is not None else math.inf
+        histogram.max = data["max"]
+        return histogram
+
+class WeatherCache:
+    # TTL cache with LRU eviction, shared by the UI thread and the async loop thread
+    def __init__(self, ttl=600, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, etag=None):
+        # `etag` is only kept by PersistentWeatherCache
+        self._store(key, value, time.monotonic() + self.ttl)
+
+    def _store(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class PersistentWeatherCache(WeatherCache):
+    # WeatherCache backed by a SQLite file in WAL mode so observations survive restarts.
+    # Puts are flushed to disk in one transaction every `flush_interval` seconds by a
+    # background thread, memory misses for keys known to be fresh on disk fall through to
+    # the file, and the newest rows are loaded into memory at startup. Expired rows are kept
+    # with their ETag so validators() can seed conditional requests after a restart
+    def __init__(self, path="weather_cache.sqlite3", ttl=600, max_entries=256, max_rows=10000, flush_interval=2.0):
+        super().__init__(ttl, max_entries)
+        self.path = path
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.disk_hits = 0
+        self.disk_evictions = 0
+        self._pending = {}  # key -> (observation, fetched_at, ttl, etag) not yet on disk
+        self._on_disk = {}  # key -> wall-clock expiry of the row on disk or pending
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS observations ("
+                "city TEXT NOT NULL, units TEXT NOT NULL, observation TEXT NOT NULL, "
+                "fetched_at REAL NOT NULL, ttl REAL NOT NULL, etag TEXT, PRIMARY KEY (city, units))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS observations_fetched_at ON observations (fetched_at)")
+        self.warm()
+        
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def warm(self):
+        # Load the newest unexpired rows into memory, oldest first so LRU order matches fetch order
+        now = time.time()
+        with self._db_lock:
+            self._on_disk = {(city, units): expires_at for city, units, expires_at in self._db.execute(
+                "SELECT city, units, fetched_at + ttl FROM observations WHERE fetched_at + ttl > ?", (now,))}
+            rows = self._db.execute(
+                "SELECT city, units, observation, fetched_at, ttl FROM observations "
+                "WHERE fetched_at + ttl > ? ORDER BY fetched_at DESC LIMIT ?",
+                (now, self.max_entries)
+            ).fetchall()
+        for city, units, observation, fetched_at, ttl in reversed(rows):
+            self._store((city, units), self._decode(observation), time.monotonic() + fetched_at + ttl - now)
+        return len(rows)
+
+    def get(self, key):
+        value = super().get(key)
+        if value is not None:
+            return value
+        
+        # Misses for keys with nothing fresh on disk never touch the file (or wait on a flush);
+        # a plain dict read is safe without the lock
+        expires_at = self._on_disk.get(key)
+        if expires_at is None or expires_at <= time.time():
+            return None
+        
+        with self._db_lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                value, fetched_at, ttl, _ = pending
+            else:
+                row = self._db.execute(
+                    "SELECT observation, fetched_at, ttl FROM observations WHERE city = ? AND units = ?", key
+                ).fetchone()
+                if row is None:
+                    # Evicted from disk since it was noted
+                    self._on_disk.pop(key, None)
+                    return None
+                observation, fetched_at, ttl = row
+                value = None
+        
+        remaining = fetched_at + ttl - time.time()
+        if remaining <= 0:
+            return None
+        if value is None:
+            value = self._decode(observation)
+        self._store(key, value, time.monotonic() + remaining)
+        with self._lock:
+            # A disk hit, not the memory miss counted above
+            self.misses -= 1
+            self.hits += 1
+            self.disk_hits += 1
+        return value
+
+    def put(self, key, value, etag=None):
+        super().put(key, value)
+        fetched_at = time.time()
+        with self._db_lock:
+            self._pending[key] = (value, fetched_at, self.ttl, etag)
+            self._on_disk[key] = fetched_at + self.ttl
+
+    def validators(self, limit):
+        # (key, observation, etag) for the newest rows that have an ETag, expired or not
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT city, units, observation, etag FROM observations WHERE etag IS NOT NULL "
+                "ORDER BY fetched_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [((city, units), self._decode(observation), etag) for city, units, observation, etag in reversed(rows)]
+
+    def flush(self):
+        with self._db_lock:
+            if not self._pending:
+                return
+            rows = [(city, units, self._encode(value), fetched_at, ttl, etag)
+                    for (city, units), (value, fetched_at, ttl, etag) in self._pending.items()]
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO observations VALUES (?, ?, ?, ?, ?, ?)", rows)
+                # Expired rows are kept (validators() reuses their ETags); only the row count is bounded
+                evicted = self._db.execute(
+                    "DELETE FROM observations WHERE rowid IN "
+                    "(SELECT rowid FROM observations ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,)
+                )
+                self.disk_evictions += max(evicted.rowcount, 0)
+            self._pending.clear()
+
+    def disk_rows(self):
+        with self._db_lock:
+            return self._db.execute("SELECT COUNT(*) FROM observations").fetchone()[0] + len(self._pending)
+
+    def clear(self):
+        super().clear()
+        with self._db_lock:
+            self._pending.clear()
+            self._on_disk = {}
+            with self._db:
+                self._db.execute("DELETE FROM observations")
+
+    def close(self):
+        self._closed.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass  # rows stay pending and are retried on the next flush
+
+    @staticmethod
+    def _encode(observation):
+        return json.dumps([getattr(observation, field) for field in WeatherObservation.__slots__])
+
+    @staticmethod
+    def _decode(observation):
+        return WeatherObservation(*json.loads(observation))
+
+# Request sources that went upstream, and so are recorded as metrics
+UPSTREAM_SOURCES = ("network", "unchanged")
+
+class _Validators:
+    __slots__ = ("observation", "etag", "last_modified", "cadence")
+
+    def __init__(self, observation, etag, last_modified, cadence):
+        self.observation = observation
+        self.etag = etag
+        self.last_modified = last_modified
+        self.cadence = cadence
+
+class ChangeTracker:
+    # Last observation and validators (dt, ETag, Last-Modified) per cache key. Used to send
+    # conditional requests, to skip decoding payloads whose dt hasn't moved, and to predict
+    # when upstream will next publish from the observed update cadence
+    DT_PATTERN = re.compile(rb'"dt"\s*:\s*(\d+)')
+
+    def __init__(self, cadence=600, min_cadence=60, max_cadence=3600, retry=60, max_entries=10000):
+        self.cadence = cadence
+        self.min_cadence = min_cadence
+        self.max_cadence = max_cadence
+        self.retry = retry
+        self.max_entries = max_entries
+        self.not_modified = 0  # 304 responses
+        self.unchanged = 0  # 200 responses whose dt matched the last observation
+        self.changed = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def headers(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        headers = {}
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def remember(self, key, observation, etag):
+        # Seeds validators for `key` (e.g. from the persistent cache) unless newer ones are known
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = _Validators(observation, etag, None, self.cadence)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+    def etag(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry.etag if entry is not None else None
+
+    def decoder(self, key):
+        # decode_observation, short-circuited to the last observation when the payload's dt matches it
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return decode_observation
+        previous = entry.observation
+        
+        def decode(body):
+            match = self.DT_PATTERN.search(body)
+            if match is not None and int(match.group(1)) == previous.dt:
+                return previous
+            return decode_observation(body)
+        return decode
+
+    def resolve(self, key, status, data, headers):
+        # (status, observation, changed) for a response; a 304 becomes a 200 with the last observation
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            
+            if status == 304 and entry is not None:
+                self.not_modified += 1
+                return 200, entry.observation, False
+            if status != 200:
+                return status, data, True
+            
+            etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+            if entry is not None and data.dt <= entry.observation.dt:
+                # Same (or an older, out of order) observation; keep the newest one
+                entry.etag = etag or entry.etag
+                entry.last_modified = last_modified or entry.last_modified
+                self.unchanged += 1
+                return 200, entry.observation, False
+            
+            cadence = self.cadence
+            if entry is not None:
+                # Smooth the observed gap between upstream updates
+                observed = min(max(data.dt - entry.observation.dt, self.min_cadence), self.max_cadence)
+                cadence = (entry.cadence + observed) / 2
+            self._entries[key] = _Validators(data, etag, last_modified, cadence)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.changed += 1
+            return 200, data, True
+
+    def next_refresh(self, key, now=None):
+        # Wall-clock time when upstream should have a newer observation for `key`
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return now
+        expected = entry.observation.dt + entry.cadence
+        return expected if expected > now else now + self.retry
+
+class RefreshSchedule:
+    # Min-heap of cities keyed on their next-due wall-clock time, with per-city refresh intervals
+    # and jitter so refreshes don't bunch up. Records how late each refresh started (missed
+    # deadlines) and when each city was last confirmed current (freshness).
+    # Only updated from the async loop thread.
+    def __init__(self, interval=300, jitter=0.1, grace=5.0):
+        self.interval = interval
+        self.jitter = jitter  # fraction of a city's interval
+        self.grace = grace  # seconds late before a refresh counts as a missed deadline
+        self.intervals = {}
+        self.refreshed_at = {}
+        self.started = 0
+        self.refreshes = 0
+        self.missed = 0
+        self.max_lateness = 0.0
+        self._heap = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def add(self, city, interval=None, due=None):
+        self.intervals[city] = interval or self.interval
+        self.push(city, time.time() if due is None else due)
+
+    def push(self, city, due):
+        heapq.heappush(self._heap, (due, next(self._seq), city))
+
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    def pop(self, now=None):
+        # The most overdue city; its lateness is recorded against the deadline
+        due, _, city = heapq.heappop(self._heap)
+        lateness = (time.time() if now is None else now) - due
+        self.started += 1
+        self.max_lateness = max(self.max_lateness, lateness)
+        if lateness > self.grace:
+            self.missed += 1
+        return city
+
+    def completed(self, city, ok, now=None, expected=None):
+        # Reschedules `city` one jittered interval out, or sooner when `expected` (when its
+        # data should next change) comes first
+        now = time.time() if now is None else now
+        if ok:
+            self.refreshes += 1
+            self.refreshed_at[city] = now
+        interval = self.intervals[city]
+        delay = interval if expected is None else min(interval, max(expected - now, 0.0))
+        self.push(city, now + max(delay + random.uniform(-self.jitter, self.jitter) * interval, 0.0))
+
+    def freshness(self, now=None):
+        # (mean, p95, max) seconds since the refreshed cities were last confirmed current
+        if not self.refreshed_at:
+            return None
+        now = time.time() if now is None else now
+        # Copied with list() first since the dashboard reads this from the UI thread
+        ages = now - np.array(list(self.refreshed_at.values()))
+        return float(ages.mean()), float(np.percentile(ages, 95)), float(ages.max())
+
+    def summary(self):
+        freshness = self.freshness()
+        age_text = (f"data age {freshness[0]:.0f}s mean / {freshness[1]:.0f}s p95 / {freshness[2]:.0f}s max"
+                    if freshness is not None else "no data yet")
+        return (f"{len(self)} cities, {self.refreshes} refreshes, {self.missed} of {self.started} "
+                f"deadlines missed, {age_text}")
+
+class SingleFlight:
+    # Coalesces concurrent requests for the same key onto one in-flight task.
+    # Only used from the async loop thread.
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight = {}
+        self._waiters = {}
+
+    async def do(self, key, coro_factory):
+        task = self._inflight.get(key)
+        leader = task is None
+        if leader:
+            self.calls += 1
+            task = asyncio.ensure_future(coro_factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task), leader
+        except asyncio.CancelledError:
+            # Once every caller has given up (e.g. at a batch deadline), stop the upstream request too
+            if self._waiters[task] == 1:
+                task.cancel()
+            raise
+        finally:
+            remaining = self._waiters.pop(task) - 1
+            if remaining:
+                self._waiters[task] = remaining
+
+class CityIdIndex:
+    # Resolves city names to OpenWeatherMap ids using the bulk city list (if present)
+    # and ids learned from earlier /weather responses, which take precedence
+    def __init__(self, learned_path="city_ids.json", city_list_paths=("city.list.json.gz", "city.list.json")):
+        self.learned_path = learned_path
+        self.city_list_paths = city_list_paths
+        self._ids = {}
+        self._learned = {}
+        self._loaded = False
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            
+            for path in self.city_list_paths:
+                if not os.path.exists(path):
+                    continue
+                opener = gzip.open if path.endswith(".gz") else open
+                try:
+                    with opener(path, "rt", encoding="utf-8") as f:
+                        for entry in json.load(f):
+                            name = entry["name"].lower()
+                            self._ids.setdefault(name, entry["id"])
+                            if entry.get("country"):
+                                self._ids.setdefault(f"{name},{entry['country'].lower()}", entry["id"])
+                except (OSError, ValueError, KeyError):
+                    self._ids = {}
+                    continue
+                break
+            
+            if os.path.exists(self.learned_path):
+                try:
+                    with open(self.learned_path, encoding="utf-8") as f:
+                        self._learned = json.load(f)
+                except (OSError, ValueError):
+                    self._learned = {}
+            
+            self._loaded = True
+
+    def lookup(self, city):
+        key = city.strip().lower()
+        with self._lock:
+            return self._learned.get(key) or self._ids.get(key)
+
+    def learn(self, city, city_id):
+        key = city.strip().lower()
+        with self._lock:
+            if self._learned.get(key) != city_id:
+                self._learned[key] = city_id
+                self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            learned = dict(self._learned)
+            self._dirty = False
+        
+        try:
+            with open(self.learned_path, "w", encoding="utf-8") as f:
+                json.dump(learned, f)
+        except OSError:
+            pass
+
+class TokenBucket:
+    # Async token bucket: refills at `rate` tokens per second up to `burst`
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class BatchScheduler:
+    # Bounds in-flight requests with a semaphore and paces them with a token bucket.
+    # The bucket is passed in so every scheduler can draw on one shared rate limit.
+    # Only used from the async loop thread.
+    def __init__(self, max_in_flight=None, bucket=None):
+        self.max_in_flight = max_in_flight
+        self.bucket = bucket
+        self._semaphore = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.started = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def average_wait(self):
+        return self.total_wait / self.started if self.started else 0.0
+
+    async def run(self, coro_factory):
+        enqueued_at = time.monotonic()
+        self.queue_depth += 1
+        try:
+            if self._semaphore is not None:
+                await self._semaphore.acquire()
+            try:
+                if self.bucket is not None:
+                    await self.bucket.acquire()
+            except BaseException:
+                if self._semaphore is not None:
+                    self._semaphore.release()
+                raise
+        finally:
+            self.queue_depth -= 1
+        
+        wait = time.monotonic() - enqueued_at
+        self.started += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        
+        self.in_flight += 1
+        try:
+            return await coro_factory()
+        finally:
+            self.in_flight -= 1
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+class AdaptiveScheduler(BatchScheduler):
+    # AIMD limiter: the in-flight limit grows by about one per round trip while
+    # requests stay healthy and is cut multiplicatively on 429/503 responses,
+    # timeouts, connection errors or latency spikes (like TCP congestion avoidance).
+    # A spike is the p90 of the last `recent_window` healthy requests exceeding
+    # `latency_tolerance` times the p90 over `baseline_window`, so ordinary tail
+    # latency from single slow requests doesn't cut the limit.
+    # Only used from the async loop thread.
+    CONGESTION_STATUSES = (429, 503)
+
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=200, backoff=0.5,
+                 latency_tolerance=2.0, bucket=None, history=None,
+                 recent_window=20, baseline_window=500):
+        super().__init__(max_in_flight=None, bucket=bucket)
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.baseline = None  # p90 latency of healthy requests over the long window
+        self.recent = deque(maxlen=recent_window)
+        self.long = deque(maxlen=baseline_window)
+        self.cuts = 0
+        self.peak_limit = int(self.limit)
+        self.last_cut = 0.0
+        # (perf_counter, limit) samples; pass a shared deque to keep them across runs
+        self.history = history if history is not None else deque(maxlen=10000)
+        self.history.append((time.perf_counter(), int(self.limit)))
+        self.max_in_flight = int(self.limit)
+        self._condition = asyncio.Condition()
+
+    async def run(self, coro_factory):
+        enqueued_at = time.monotonic()
+        self.queue_depth += 1
+        try:
+            async with self._condition:
+                await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+                self.in_flight += 1
+            try:
+                if self.bucket is not None:
+                    await self.bucket.acquire()
+            except BaseException:
+                await self._release()
+                raise
+        finally:
+            self.queue_depth -= 1
+        
+        wait = time.monotonic() - enqueued_at
+        self.started += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        
+        started_at = time.perf_counter()
+        congested = False
+        cancelled = False
+        try:
+            result = await coro_factory()
+            status = result[0] if isinstance(result, tuple) else result
+            congested = status in self.CONGESTION_STATUSES
+            return result
+        except (asyncio.TimeoutError, aiohttp.ClientConnectionError):
+            congested = True
+            raise
+        except asyncio.CancelledError:
+            # A cancelled attempt (e.g. a hedge that lost) says nothing about upstream latency
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                self._observe(started_at, time.perf_counter() - started_at, congested)
+            await self._release()
+
+    async def _release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _observe(self, started_at, latency, congested):
+        if not congested:
+            self.recent.append(latency)
+            self.long.append(latency)
+            if len(self.recent) == self.recent.maxlen and len(self.long) >= 2 * self.recent.maxlen:
+                self.baseline = float(np.percentile(self.long, 90))
+                congested = float(np.percentile(self.recent, 90)) > self.baseline * self.latency_tolerance
+        
+        if congested:
+            # Cut at most once per round trip: ignore requests sent before the last cut
+            if started_at >= self.last_cut:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.last_cut = time.perf_counter()
+                self.cuts += 1
+                # The next spike verdict needs a full window of requests at the new limit
+                self.recent.clear()
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        
+        if int(self.limit) != self.max_in_flight:
+            self.max_in_flight = int(self.limit)
+            self.peak_limit = max(self.peak_limit, self.max_in_flight)
+            self.history.append((time.perf_counter(), self.max_in_flight))
+
+class MetricsStore:
+    # Columnar request log: fixed-size ring buffers hold the most recent `capacity`
+    # records, while per-strategy running aggregates cover every record ever made.
+    # City names are interned to ids that are recycled once no retained record uses them,
+    # so the name table never outgrows the ring.
+    # Every fetch path records here from whichever thread it runs on; readers take a
+    # snapshot() rather than reading the live buffers
+    COLUMNS = ("timestamps", "starts", "latencies", "status_codes", "strategy_ids", "city_ids", "phases")
+    AGGREGATES = ("counts", "ok_counts", "sums", "mins", "maxs")
+
+    def __init__(self, strategies, capacity=100000, max_cities=1000):
+        self.strategies = list(strategies)
+        self.capacity = capacity
+        self.max_cities = max_cities
+        self._strategy_ids = {name: i for i, name in enumerate(self.strategies)}
+        self.city_names = []
+        self._city_ids = {}
+        self._city_refs = []  # retained records per city id
+        self._free_city_ids = []
+        
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.starts = np.zeros(capacity, dtype=np.float64)  # perf_counter; end is start + latency
+        self.latencies = np.zeros(capacity, dtype=np.float64)
+        self.status_codes = np.zeros(capacity, dtype=np.int16)  # 0 when no response arrived
+        self.strategy_ids = np.zeros(capacity, dtype=np.int8)
+        self.city_ids = np.zeros(capacity, dtype=np.int32)
+        self.phases = np.zeros((capacity, len(PHASES)), dtype=np.float32)  # seconds, in PHASES order
+        self.total = 0
+        
+        # Running aggregates; latency aggregates only include successful requests
+        n = len(self.strategies)
+        self.counts = np.zeros(n, dtype=np.int64)
+        self.ok_counts = np.zeros(n, dtype=np.int64)
+        self.sums = np.zeros(n, dtype=np.float64)
+        self.mins = np.full(n, np.inf)
+        self.maxs = np.full(n, -np.inf)
+        
+        # Tail latency for successful requests, per strategy and per city (least recently seen
+        # cities are dropped past `max_cities`)
+        self.histograms = {name: LatencyHistogram() for name in self.strategies}
+        self.city_histograms = OrderedDict()
+        
+        self.contended = 0  # lock acquisitions that had to wait for another thread
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        if not self._lock.acquire(blocking=False):
+            self._lock.acquire()
+            self.contended += 1
+        try:
+            yield
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        # Consistent copy with the same read API, taken in one critical section.
+        # Per-city histograms are left out; export_histograms() reads them under the lock
+        with self._locked():
+            snapshot = object.__new__(MetricsStore)
+            snapshot.__dict__.update(self.__dict__)
+            for name in self.COLUMNS + self.AGGREGATES:
+                setattr(snapshot, name, getattr(self, name).copy())
+            snapshot.city_names = list(self.city_names)
+            snapshot._city_ids = dict(self._city_ids)
+            snapshot._city_refs = list(self._city_refs)
+            snapshot._free_city_ids = list(self._free_city_ids)
+            snapshot.histograms = {name: histogram.copy() for name, histogram in self.histograms.items()}
+            snapshot.city_histograms = OrderedDict()
+            snapshot._lock = threading.Lock()
+        return snapshot
+
+    def intern_city(self, city):
+        # Id for `city` with one more reference; call with the lock held
+        city_id = self._city_ids.get(city)
+        if city_id is None:
+            if self._free_city_ids:
+                city_id = self._free_city_ids.pop()
+                self.city_names[city_id] = city
+                self._city_refs[city_id] = 0
+            else:
+                city_id = len(self.city_names)
+                self.city_names.append(city)
+                self._city_refs.append(0)
+            self._city_ids[city] = city_id
+        self._city_refs[city_id] += 1
+        return city_id
+
+    def _release_city(self, city_id):
+        # Drops the reference held by an overwritten record, freeing the id at zero
+        self._city_refs[city_id] -= 1
+        if not self._city_refs[city_id]:
+            del self._city_ids[self.city_names[city_id]]
+            self._free_city_ids.append(city_id)
+
+    def record(self, strategy, city, latency, status=200, timestamp=None, start=None, phases=None):
+        sid = self._strategy_ids[strategy]
+        status = status if isinstance(status, int) else 0
+        with self._locked():
+            i = self.total % self.capacity
+            if self.total >= self.capacity:
+                self._release_city(int(self.city_ids[i]))
+            self.timestamps[i] = time.time() if timestamp is None else timestamp
+            self.starts[i] = time.perf_counter() - latency if start is None else start
+            self.latencies[i] = latency
+            self.status_codes[i] = status
+            self.strategy_ids[i] = sid
+            self.city_ids[i] = self.intern_city(city)
+            self.phases[i] = [phases.get(phase, 0.0) for phase in PHASES] if phases else 0.0
+            self.total += 1
+            
+            self.counts[sid] += 1
+            if status == 200:
+                self.ok_counts[sid] += 1
+                self.sums[sid] += latency
+                self.mins[sid] = min(self.mins[sid], latency)
+                self.maxs[sid] = max(self.maxs[sid], latency)
+                self.histograms[strategy].record(latency)
+                city_histogram = self.city_histograms.get(city)
+                if city_histogram is None:
+                    city_histogram = self.city_histograms[city] = LatencyHistogram()
+                    if len(self.city_histograms) > self.max_cities:
+                        self.city_histograms.popitem(last=False)
+                else:
+                    self.city_histograms.move_to_end(city)
+                city_histogram.record(latency)
+
+    def column(self, name):
+        # Oldest-first view of a buffer; only copies once the ring has wrapped
+        buffer = getattr(self, name)
+        if self.total <= self.capacity:
+            return buffer[:self.total]
+        start = self.total % self.capacity
+        return np.concatenate((buffer[start:], buffer[:start]))
+
+    def successful_latencies(self, strategy):
+        mask = (self.column("strategy_ids") == self._strategy_ids[strategy]) & (self.column("status_codes") == 200)
+        return self.column("latencies")[mask]
+
+    def recent_latencies(self, strategy, n, exclude_queue=False):
+        # Latest `n` successful latencies, optionally without time spent queued
+        mask = (self.column("strategy_ids") == self._strategy_ids[strategy]) & (self.column("status_codes") == 200)
+        latencies = self.column("latencies")[mask][-n:]
+        if exclude_queue:
+            latencies = latencies - self.column("phases")[mask][-n:, PHASES.index("queue")]
+        return latencies
+
+    def recent(self, n=10):
+        # Newest-last (strategy, city, latency, status) tuples
+        rows = []
+        for offset in range(min(n, len(self)), 0, -1):
+            i = (self.total - offset) % self.capacity
+            rows.append((self.strategies[self.strategy_ids[i]], self.city_names[self.city_ids[i]],
+                         float(self.latencies[i]), int(self.status_codes[i])))
+        return rows
+
+    def count(self, strategy):
+        return int(self.counts[self._strategy_ids[strategy]])
+
+    def mean(self, strategy):
+        sid = self._strategy_ids[strategy]
+        return self.sums[sid] / self.ok_counts[sid] if self.ok_counts[sid] else 0.0
+
+    def success_rate(self, strategy):
+        sid = self._strategy_ids[strategy]
+        return self.ok_counts[sid] / self.counts[sid] if self.counts[sid] else 0.0
+
+    def export_histograms(self):
+        # Same per-strategy shape as weather_bench reports, so `weather_bench --merge` combines both
+        def summary(histogram):
+            return {
+                "ok": histogram.total,
+                "latency_s": {f"p{p:g}": round(value, 5) for p, value in histogram.percentiles().items()},
+                "histogram": histogram.to_dict()
+            }
+        
+        with self._locked():
+            return {
+                "strategies": {name: summary(histogram) for name, histogram in self.histograms.items()},
+                "cities": {city: summary(histogram) for city, histogram in self.city_histograms.items()}
+            }
+
+    def fastest(self):
+        return float(self.mins.min()) if self.ok_counts.any() else None
+
+    def slowest(self):
+        return float(self.maxs.max()) if self.ok_counts.any() else None
+
+class ForecastSeries:
+    # Forecasts for a batch of cities on one shared time grid: `values` is
+    # (timestamps x cities x FORECAST_VARIABLES), NaN where a city has no step
+    def __init__(self, cities, series):
+        # `series` holds one (times, values) pair from decode_forecast per city, in `cities` order
+        self.cities = list(cities)
+        all_times = np.concatenate([times for times, _ in series]) if series else np.zeros(0, dtype=np.int64)
+        self.times = np.unique(all_times)
+        self.values = np.full((len(self.times), len(self.cities), len(FORECAST_VARIABLES)), np.nan, dtype=np.float32)
+        if series:
+            rows = np.searchsorted(self.times, all_times)
+            columns = np.repeat(np.arange(len(series)), [len(times) for times, _ in series])
+            self.values[rows, columns] = np.concatenate([values for _, values in series])
+
+    def variable(self, name):
+        return self.values[:, :, FORECAST_VARIABLES.index(name)]
+
+    def daily(self, name="temp"):
+        # (day starts, min, max, mean) with each statistic shaped (days x cities); days are UTC
+        series = self.variable(name)
+        days = self.times // 86400
+        starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        present = ~np.isnan(series)
+        counts = np.add.reduceat(present, starts, axis=0)
+        sums = np.add.reduceat(np.where(present, series, 0), starts, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = sums / counts
+        return (days[starts] * 86400, np.fmin.reduceat(series, starts, axis=0),
+                np.fmax.reduceat(series, starts, axis=0), mean)
+
+    def anomaly(self, name="temp"):
+        # Each city's deviation from the batch mean at every timestamp (timestamps x cities)
+        series = self.variable(name)
+        return series - np.nanmean(series, axis=1, keepdims=True)
+
+    def top_k(self, k=10, name="temp"):
+        # Indices of the k cities with the highest peak, highest first
+        peaks = np.nanmax(self.variable(name), axis=0)
+        k = min(k, len(peaks))
+        if not k:
+            return np.zeros(0, dtype=np.int64)
+        order = np.argpartition(-peaks, k - 1)[:k]
+        return order[np.argsort(-peaks[order])]
+
+def iter_city_file(path):
+    # Lazily yields (city, bytes read so far) from a newline separated or CSV city list;
+    # for CSV the first column is used and a "city"/"name" header row is skipped
+    is_csv = path.lower().endswith(".csv")
+    consumed = 0
+    with open(path, "rb") as f:
+        for line_number, raw in enumerate(f):
+            consumed += len(raw)
+            line = raw.decode("utf-8-sig" if line_number == 0 else "utf-8", errors="replace").strip()
+            if is_csv and line:
+                fields = next(csv.reader([line]), [""])
+                line = fields[0].strip()
+                if line_number == 0 and line.lower() in ("city", "name"):
+                    continue
+            if line:
+                yield line, consumed
+
+class ResultWriter:
+    # Appends result rows to a CSV or JSON Lines file from its own thread, so the
+    # event loop never waits on the disk
+    COLUMNS = ("city", "temp", "weather", "time", "method")
+
+    def __init__(self, path):
+        self.path = path
+        self.jsonl = path.lower().endswith((".jsonl", ".ndjson"))
+        self.rows_written = 0
+        self._file = open(path, "w", encoding="utf-8", newline="")
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, row):
+        self._queue.put(row)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        with self._file as f:
+            writer = None if self.jsonl else csv.writer(f)
+            if writer is not None:
+                writer.writerow(self.COLUMNS)
+            while True:
+                row = self._queue.get()
+                if row is None:
+                    break
+                if writer is not None:
+                    writer.writerow(row)
+                else:
+                    f.write(json.dumps(dict(zip(self.COLUMNS, row))) + "\n")
+                self.rows_written += 1
+
+class ResultStore:
+    # Columnar store behind the results table: the display values of each row plus numeric
+    # columns that sorting and filtering work on. Rows live in a ring of `capacity` slots, so
+    # memory stays bounded however large a batch gets (the oldest rows are overwritten).
+    # Only used from the UI thread.
+    COLUMNS = ("City", "Temp", "Weather", "Time", "Method")
+    NUMERIC = {"Temp": 1, "Time": 3}
+
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self.values = np.empty((capacity, len(self.COLUMNS)), dtype=object)
+        self.numbers = np.full((capacity, len(self.COLUMNS)), np.nan)
+        self.failed = np.zeros(capacity, dtype=bool)
+        self.keys = np.empty(capacity, dtype=object)
+        self.count = 0  # rows ever appended since the last clear
+        self.generation = 0  # bumped on every change so views know to redraw
+        self._slots = {}  # key -> slot for rows that are updated in place
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, values, key=None):
+        slot = self.count % self.capacity
+        previous = self.keys[slot]
+        if previous is not None and self._slots.get(previous) == slot:
+            del self._slots[previous]
+        self.count += 1
+        self.keys[slot] = key
+        if key is not None:
+            self._slots[key] = slot
+        self._write(slot, values)
+
+    def extend(self, rows):
+        for values in rows:
+            self.append(values)
+
+    def upsert(self, rows):
+        # Rows keyed on the city replace that city's row instead of adding one
+        for values in rows:
+            slot = self._slots.get(values[0])
+            if slot is None:
+                self.append(values, key=values[0])
+            else:
+                self._write(slot, values)
+
+    def clear(self):
+        # Stale slots are simply overwritten later
+        self.count = 0
+        self._slots = {}
+        self.generation += 1
+
+    def row(self, slot):
+        return tuple(self.values[slot])
+
+    def slot_at(self, position):
+        # Slot of the `position`th row in arrival order
+        return (self.count - len(self) + position) % self.capacity
+
+    def select(self, failures_only=False, sort=None, descending=False):
+        # Slots in display order, filtered and sorted on the columns rather than row by row
+        slots = (np.arange(len(self)) + self.count - len(self)) % self.capacity
+        if failures_only:
+            slots = slots[self.failed[slots]]
+        if sort is not None:
+            if sort in self.NUMERIC:
+                keys = self.numbers[slots, self.NUMERIC[sort]]
+                # Negating keeps rows without a number (NaN) last either way
+                order = np.argsort(-keys if descending else keys, kind="stable")
+            else:
+                order = np.argsort(self.values[slots, self.COLUMNS.index(sort)].astype(str), kind="stable")
+                if descending:
+                    order = order[::-1]
+            slots = slots[order]
+        return slots
+
+    def _write(self, slot, values):
+        self.values[slot] = values
+        for i in self.NUMERIC.values():
+            try:
+                self.numbers[slot, i] = float(values[i])
+            except (TypeError, ValueError):
+                self.numbers[slot, i] = np.nan
+        self.failed[slot] = values[1] == "N/A"
+        self.generation += 1